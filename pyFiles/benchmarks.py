@@ -0,0 +1,413 @@
+#---------------------------------------------------------------------------------
+#  Benchmarks - timing and accuracy comparisons for the numeric kernels in this
+#               directory. Run as a script to print the tables, or with the
+#               suite argument to run the regression suite (see run_suite and
+#               python benchmarks.py --help).
+#
+# Author: Naor Movshovitz (nmovshov at gee mail dot com)
+#---------------------------------------------------------------------------------
+import os, sys, time, timeit, subprocess
+import json, platform, argparse
+import numpy as np
+import nutils
+import physunits
+import numba_demo
+import gdc
+
+def _best_time(fun, *args, repeat=3, setup=None):
+    """Return best wall-clock time of repeat calls to fun(*args)."""
+    best = np.inf
+    for k in range(repeat):
+        if setup is not None:
+            setup()
+        tic = time.perf_counter()
+        fun(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+def _run_times(fun, args, repeat, setup=None, timed=False):
+    """Return the wall-clock times of the first and of repeat more calls.
+
+    With timed=True fun measures itself and returns the time in seconds.
+    """
+    ts = []
+    for k in range(repeat + 1):
+        if setup is not None:
+            setup()
+        tic = time.perf_counter()
+        t = fun(*args)
+        ts.append(t if timed else time.perf_counter() - tic)
+    return ts[0], ts[1:]
+
+def bench_gauleg(ns=(10, 100, 1000, 10**4, 10**5, 10**6), newton_max=10**4,
+                 gw_max=2000):
+    """Compare gauleg methods for timing and accuracy.
+
+    For each n and method print the time to build the rule from scratch (with
+    the node cache cleared), the max node difference from the Newton rule (where
+    that is affordable, n <= newton_max), and the error in the integral of
+    cos(w*x) on [-1,1] with w = n/2, which the n-point rule resolves. The O(n^2)
+    memory golub-welsch rule is only run for n <= gw_max.
+    """
+
+    print("gauleg: build time, node difference vs newton, oscillatory integral error")
+    print(f"{'n':>8} {'method':>13} {'time [s]':>10} {'|dx|max':>10} {'I err':>10}")
+    for n in ns:
+        xref = None
+        for method in ('newton', 'asymptotic', 'golub-welsch'):
+            if method == 'newton' and n > newton_max:
+                continue
+            if method == 'golub-welsch' and n > gw_max:
+                continue
+            t = _best_time(nutils.gauleg, -1, 1, n, method,
+                           repeat=1 if n > 10**4 else 3,
+                           setup=nutils._gauleg_ref.cache_clear)
+            x, w = nutils.gauleg(-1, 1, n, method)
+            if method == 'newton':
+                xref = x
+            dx = np.abs(x - xref).max() if xref is not None else np.nan
+            om = n/2
+            err = abs(np.sum(w*np.cos(om*x)) - 2*np.sin(om)/om)
+            print(f"{n:8d} {method:>13} {t:10.3g} {dx:10.2g} {err:10.2g}")
+    return
+
+def bench_Pn(npts=10**7, nmax=12):
+    """Time nutils.Pn against scipy.special.eval_legendre on a large grid.
+
+    For each degree with an explicit implementation (n <= nmax) print the best
+    time of Pn in float64 and float32, the time of eval_legendre, the speedup,
+    and the max difference between Pn and eval_legendre.
+    """
+
+    from scipy.special import eval_legendre
+    x = np.linspace(-1, 1, npts)
+    x32 = x.astype(np.float32)
+    y = np.empty_like(x)
+    y32 = np.empty_like(x32)
+    print(f"Pn vs eval_legendre on {npts} points")
+    print(f"{'n':>3} {'Pn [s]':>9} {'Pn32 [s]':>9} {'scipy [s]':>9} {'speedup':>8} "
+          f"{'max diff':>9}")
+    for n in range(nmax + 1):
+        t = _best_time(nutils.Pn, n, x, y)
+        t32 = _best_time(nutils.Pn, n, x32, y32, np.float32)
+        ts = _best_time(eval_legendre, n, x)
+        err = np.abs(nutils.Pn(n, x) - eval_legendre(n, x)).max()
+        print(f"{n:3d} {t:9.3g} {t32:9.3g} {ts:9.3g} {ts/t:8.1f} {err:9.2g}")
+    return
+
+def bench_physunits(number=100000):
+    """Time the preal arithmetic dunders against the same operations on floats.
+
+    Print the mean time per operation, in microseconds, for preal operands and
+    for plain floats, and their ratio (the overhead of unit checking).
+    """
+
+    pu = physunits
+    ns = dict(a=3.0*pu.meter, b=2.0*pu.meter, c=2.0*pu.second, d=2.0*pu.radian,
+              x=3.0, y=2.0, z=2.0)
+    ops = [('__add__', 'a + b', 'x + y'),
+           ('__radd__', '2.0 + d', '2.0 + z'),
+           ('__sub__', 'a - b', 'x - y'),
+           ('__rsub__', '2.0 - d', '2.0 - z'),
+           ('__mul__', 'a*c', 'x*z'),
+           ('__rmul__', '2.0*a', '2.0*x'),
+           ('__truediv__', 'a/c', 'x/z'),
+           ('__rtruediv__', '2.0/c', '2.0/z'),
+           ('__pow__', 'a**2', 'x**2'),
+           ('__pow__ (1/2)', 'a**0.5', 'x**0.5'),
+           ('__rpow__', '2.0**d', '2.0**z'),
+           ('__neg__', '-a', '-x'),
+           ('__abs__', 'abs(a)', 'abs(x)'),
+           ('__lt__', 'a < b', 'x < y'),
+           ('isdimless', 'd.isdimless()', 'z == z'),
+           ('sin', 'sin(d)', 'math.sin(z)')]
+    ns.update(sin=pu.sin, math=__import__('math'))
+    print(f"preal arithmetic, {number} calls per operation")
+    print(f"{'operation':>15} {'preal [us]':>11} {'float [us]':>11} {'ratio':>7}")
+    for name, pstmt, fstmt in ops:
+        tp = timeit.timeit(pstmt, globals=ns, number=number)/number*1e6
+        tf = timeit.timeit(fstmt, globals=ns, number=number)/number*1e6
+        print(f"{name:>15} {tp:11.3f} {tf:11.3f} {tp/tf:7.1f}")
+    return
+
+def _direct_sample(x, y, z, m, idx):
+    """Exact potential at particles idx by a vectorized direct sum."""
+    U = np.empty(len(idx))
+    for k, i in enumerate(idx):
+        r = np.sqrt((x - x[i])**2 + (y - y[i])**2 + (z - z[i])**2)
+        r[i] = np.inf
+        U[k] = -np.sum(m/r)
+    return U
+
+def bench_tree_potential(ns=(10**3, 10**4, 10**5), thetas=(0.3, 0.5, 0.7, 1.0),
+                         direct_max=3*10**4, nsample=200):
+    """Compare numba_demo.potential_tree with the direct sum for speed and accuracy.
+
+    Particles are uniform in the unit cube with random masses. For each N print
+    the time of the direct sum (for N <= direct_max) and, for each opening angle
+    theta, the tree time and the max and rms relative error of the potential at
+    nsample random particles (checked against an exact vectorized sum).
+    """
+
+    rng = np.random.default_rng(0)
+    x, y, z, m = rng.random((4, 100))
+    numba_demo.potential(x, y, z, m) # compile
+    numba_demo.potential_tree(x, y, z, m)
+    print("potential_tree vs direct sum")
+    print(f"{'N':>8} {'theta':>6} {'tree [s]':>9} {'direct [s]':>10} {'speedup':>8} "
+          f"{'max err':>9} {'rms err':>9}")
+    for n in ns:
+        x, y, z, m = rng.random((4, n))
+        idx = rng.choice(n, min(n, nsample), replace=False)
+        U0 = _direct_sample(x, y, z, m, idx)
+        td = np.nan
+        if n <= direct_max:
+            td = _best_time(numba_demo.potential, x, y, z, m, repeat=1)
+        for theta in thetas:
+            t = _best_time(numba_demo.potential_tree, x, y, z, m, None, theta,
+                           repeat=1 if n > 10**4 else 3)
+            U = numba_demo.potential_tree(x, y, z, m, None, theta)
+            err = np.abs(U[idx]/U0 - 1)
+            print(f"{n:8d} {theta:6.2f} {t:9.3g} {td:10.3g} {td/t:8.1f} "
+                  f"{err.max():9.2g} {np.sqrt(np.mean(err**2)):9.2g}")
+    return
+
+def bench_pot_scaling(ns=(10**4, 10**5), threads=None):
+    """Thread scaling of numba_demo.potential_parallel against the serial pot.
+
+    For each N print the time of the serial symmetric kernel and of the
+    parallel kernel in float64 and in compensated float32 for each thread count
+    (default 1, 2, 4, ... up to all numba threads), with the speedup over pot
+    and the max relative difference of the float32 result.
+    """
+
+    import numba
+    nmax = numba.config.NUMBA_NUM_THREADS
+    if threads is None:
+        threads = sorted({min(2**k, nmax) for k in range(nmax.bit_length() + 1)})
+    rng = np.random.default_rng(0)
+    x, y, z, m = rng.random((4, 100))
+    numba_demo.potential(x, y, z, m) # compile
+    numba_demo.potential_parallel(x, y, z, m)
+    numba_demo.potential_parallel(x, y, z, m, dtype=np.float32)
+    print(f"potential_parallel thread scaling ({nmax} threads available)")
+    print(f"{'N':>7} {'threads':>7} {'pot [s]':>8} {'f64 [s]':>8} {'speedup':>8} "
+          f"{'f32 [s]':>8} {'speedup':>8} {'f32 err':>8}")
+    was = numba.get_num_threads()
+    try:
+        for n in ns:
+            x, y, z, m = rng.random((4, n))
+            t0 = _best_time(numba_demo.potential, x, y, z, m, repeat=1)
+            U0 = numba_demo.potential(x, y, z, m)
+            for k in threads:
+                numba.set_num_threads(k)
+                t = _best_time(numba_demo.potential_parallel, x, y, z, m, repeat=1)
+                t32 = _best_time(numba_demo.potential_parallel, x, y, z, m, None,
+                                 np.float32, repeat=1)
+                U32 = numba_demo.potential_parallel(x, y, z, m, dtype=np.float32)
+                err = np.abs(U32/U0 - 1).max()
+                print(f"{n:7d} {k:7d} {t0:8.3g} {t:8.3g} {t0/t:8.2f} "
+                      f"{t32:8.3g} {t0/t32:8.2f} {err:8.2g}")
+    finally:
+        numba.set_num_threads(was)
+    return
+
+def bench_import(module='physunits', repeat=7):
+    """Time a fresh import of module in a new interpreter.
+
+    numpy is imported first and not counted. The first run (which also writes
+    the bytecode cache, if the directory allows it) is discarded, and the best
+    of the remaining runs is printed, in milliseconds.
+    """
+
+    first, ts = _run_times(_import_time, (module,), repeat, timed=True)
+    print(f"import {module}: {min(ts)*1e3:.2f} ms (best of {repeat})")
+    return
+
+def _import_time(module):
+    """Return the time to import module in a new interpreter, in seconds."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = (f"import sys, time, numpy; sys.path.insert(0, {here!r}); "
+            f"t = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - t)")
+    out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return float(out)
+
+def bench_disruption_level(n=10**6):
+    """Throughput of gdc.disruption_level on a synthetic collision log.
+
+    For each scaling law print the time to score n impact pairs with the numpy
+    path and with the numba kernel (jit=True, compiled beforehand), and the
+    resulting throughput in millions of pairs per second.
+    """
+
+    rng = np.random.default_rng(0)
+    R = 10**rng.uniform(4, 6, n)
+    r = R*rng.uniform(0.05, 1, n)
+    rho = rng.uniform(900, 3500, n)
+    MRHO = np.where(rng.random(n) < 0.5, rho, 4*np.pi/3*rho*R**3)
+    v = rng.uniform(10, 8000, n)
+    theta = rng.uniform(0, 0.49*np.pi, n)
+    print(f"disruption_level on {n} impact pairs")
+    print(f"{'scaling':>8} {'numpy [s]':>10} {'Mpairs/s':>9} {'jit [s]':>9} "
+          f"{'Mpairs/s':>9}")
+    for scaling in ('METAL15', 'LS12', 'BA99'):
+        args = (R, MRHO, r, 1000.0, v, theta, scaling)
+        gdc.disruption_level(*(a[:10] if np.ndim(a) else a for a in args), jit=True)
+        t = _best_time(gdc.disruption_level, *args)
+        tj = _best_time(lambda: gdc.disruption_level(*args, jit=True))
+        print(f"{scaling:>8} {t:10.3g} {n/t/1e6:9.1f} {tj:9.3g} {n/tj/1e6:9.1f}")
+    return
+
+### Regression suite
+# Suite cases whose fun returns its own time (e.g. excluding interpreter start)
+_SELF_TIMED = {'import_physunits'}
+
+def _suite_cases():
+    """Return {name: (fun, make_args(n), setup, default sizes)} for run_suite."""
+    rng = np.random.default_rng(0)
+    def particles(n):
+        x, y, z, m = rng.random((4, n))
+        return x, y, z, m, np.ones(n, dtype=bool)
+    def points(n):
+        data = rng.random((n, 3))
+        return data, 0.5*n**(-1/3) # about one neighbor per point
+    return {
+        'pot': (numba_demo.pot, particles, None, (1000, 3000, 10000)),
+        '_potential': (numba_demo._potential, particles, None, (100, 200, 400)),
+        'gauleg': (nutils.gauleg, lambda n: (-1, 1, n),
+                   nutils._gauleg_ref.cache_clear, (100, 1000, 10000)),
+        'Pn': (nutils.Pn, lambda n: (8, np.linspace(-1, 1, n)), None,
+               (10**4, 10**5, 10**6)),
+        'eclazz': (nutils.eclazz, points, None, (10**3, 10**4, 10**5)),
+        'import_physunits': (_import_time, lambda n: ('physunits',), None, (1,)),
+        }
+
+def run_suite(kernels=None, sizes=None, repeat=5, json_path=None,
+              baseline=None, tolerance=1.25):
+    """Time the project's numeric kernels over a sweep of problem sizes.
+
+    Parameters
+    ----------
+    kernels : sequence of str, optional
+        Names of kernels to run (default all): pot, _potential, gauleg, Pn,
+        eclazz, import_physunits (the time of a fresh import, which always
+        runs at its own n = 1).
+    sizes : sequence of int, optional
+        Problem sizes to use for every kernel (default: each kernel's own).
+    repeat : int
+        Number of timed calls per size, after one warm-up call whose time
+        (which includes JIT compilation on the first size) is reported
+        separately.
+    json_path : str, optional
+        Write the results, with machine and version info, to this JSON file.
+    baseline : str or dict, optional
+        Results from an earlier run (or the path to their JSON file) to compare
+        against. Entries whose best time grew by more than a factor tolerance
+        are reported as regressions.
+
+    Returns
+    -------
+    results : dict
+        {'meta': {...}, 'results': [{'kernel', 'n', 'warmup', 'best',
+        'median', 'repeat'}, ...]}.
+    regressions : list
+        (kernel, n, baseline best, best) for each regression found.
+    """
+
+    cases = _suite_cases()
+    if kernels is None:
+        kernels = list(cases)
+    import numba
+    meta = dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                platform=platform.platform(), python=platform.python_version(),
+                numpy=np.__version__, numba=numba.__version__,
+                cpus=os.cpu_count(), threads=numba.get_num_threads())
+    rows = []
+    print(f"{'kernel':>16} {'n':>8} {'warmup [s]':>10} {'best [s]':>10} "
+          f"{'median [s]':>10}")
+    for name in kernels:
+        fun, make_args, setup, ns = cases[name]
+        if sizes is not None and name not in _SELF_TIMED:
+            ns = sizes
+        for n in ns:
+            args = make_args(n)
+            first, ts = _run_times(fun, args, repeat, setup,
+                                   timed=name in _SELF_TIMED)
+            row = dict(kernel=name, n=int(n), warmup=first, best=min(ts),
+                       median=float(np.median(ts)), repeat=repeat)
+            rows.append(row)
+            print(f"{name:>16} {n:8d} {first:10.3g} {row['best']:10.3g} "
+                  f"{row['median']:10.3g}")
+    results = dict(meta=meta, results=rows)
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=1)
+    regressions = []
+    if baseline is not None:
+        regressions = compare_results(results, baseline, tolerance)
+    return results, regressions
+
+def compare_results(results, baseline, tolerance=1.25):
+    """Compare best times of two run_suite results and print the ratios.
+
+    baseline may be a results dict or the path to a JSON file written by
+    run_suite. Returns the list of (kernel, n, baseline best, best) entries
+    that are slower than the baseline by more than a factor tolerance.
+    """
+
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    old = {(r['kernel'], r['n']): r['best'] for r in baseline['results']}
+    regressions = []
+    print(f"comparison with baseline from {baseline['meta'].get('date', '?')}")
+    print(f"{'kernel':>16} {'n':>8} {'baseline [s]':>12} {'now [s]':>10} "
+          f"{'ratio':>7}")
+    for r in results['results']:
+        key = (r['kernel'], r['n'])
+        if key not in old:
+            continue
+        ratio = r['best']/old[key]
+        flag = '  REGRESSION' if ratio > tolerance else ''
+        print(f"{key[0]:>16} {key[1]:8d} {old[key]:12.3g} {r['best']:10.3g} "
+              f"{ratio:7.2f}{flag}")
+        if ratio > tolerance:
+            regressions.append((key[0], key[1], old[key], r['best']))
+    return regressions
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the numeric "
+                                     "kernels in this directory.")
+    parser.add_argument('what', nargs='?', default='tables',
+                        choices=('tables', 'suite'),
+                        help="print the comparison tables (default) or run "
+                        "the regression suite")
+    parser.add_argument('-k', '--kernels', nargs='+',
+                        help="suite kernels to run (default all)")
+    parser.add_argument('-n', '--sizes', nargs='+', type=int,
+                        help="suite problem sizes (default per kernel)")
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-o', '--json', help="write suite results to this file")
+    parser.add_argument('-b', '--baseline', help="compare with this results file")
+    parser.add_argument('-t', '--tolerance', type=float, default=1.25,
+                        help="slowdown factor reported as a regression")
+    args = parser.parse_args(argv)
+    if args.what == 'tables':
+        bench_gauleg()
+        bench_Pn()
+        bench_physunits()
+        bench_import()
+        bench_tree_potential()
+        bench_pot_scaling()
+        bench_disruption_level()
+        return 0
+    results, regressions = run_suite(args.kernels, args.sizes, args.repeat,
+                                     args.json, args.baseline, args.tolerance)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(_main())
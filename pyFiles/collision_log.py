@@ -0,0 +1,250 @@
+#---------------------------------------------------------------------------------
+#  Collision logs - stream the collision log of an N-body run through the impact
+#                   scaling kernels of gdc and psci_helpers, chunk by chunk.
+#
+# Author: Naor Movshovitz (nmovshov at gee mail dot com)
+#---------------------------------------------------------------------------------
+import sys, os
+import itertools
+import numpy as np
+import gdc
+
+# The inputs of gdc.disruption_level, in the default column order of a log
+_columns = ('R', 'MRHO', 'r', 'mrho', 'v', 'theta')
+
+def read_chunks(path, chunksize=10**6, columns=None, delimiter=None, comments='#'):
+    """Yield the columns of a collision log, chunksize rows at a time.
+
+    A .npy log (a 2D float array or a structured array) is memory-mapped and
+    sliced, anything else is read as text (whitespace or delimiter separated)
+    one chunk of lines at a time, so memory use does not depend on the size of
+    the log. The first line of a text log may be a comment holding the column
+    names; it is used as such only if it has one name per column.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        Log file name.
+    chunksize : int, (optional)
+        Number of rows per chunk.
+    columns : dict, (optional)
+        Map from the names R, MRHO, r, mrho, v, theta (see gdc.disruption_level)
+        to a column name or index in the log. Names missing from the map are
+        looked up as they are; by default they are taken in that order (theta
+        is optional and defaults to pi/4).
+    delimiter, comments : str, (optional)
+        Passed to numpy.loadtxt for text logs.
+
+    Yields
+    ------
+    chunk : dict
+        Column name -> float64 array of the chunk's rows, for every column of
+        the log plus the names R, MRHO, r, mrho, v, theta.
+    """
+
+    columns = dict(columns or {})
+    path = os.fspath(path)
+    if path.endswith('.npy'):
+        X = np.load(path, mmap_mode='r')
+        names = X.dtype.names or [str(k) for k in range(X.shape[1])]
+        for lo in range(0, X.shape[0], chunksize):
+            block = X[lo:lo + chunksize]
+            if X.dtype.names:
+                data = {name: np.asarray(block[name], dtype=float) for name in names}
+            else:
+                block = np.asarray(block, dtype=float)
+                data = {name: block[:,k] for k, name in enumerate(names)}
+            yield _named(data, names, columns)
+            pass
+        return
+
+    with open(path) as f:
+        first = f.readline()
+        names = None
+        if first.lstrip().startswith(comments):
+            header = first.lstrip()[len(comments):].split(delimiter)
+            header = [name.strip() for name in header]
+            lines = []
+        else:
+            header = None
+            lines = [first]
+        while True:
+            lines += list(itertools.islice(f, chunksize - len(lines)))
+            if not lines:
+                break
+            block = np.loadtxt(lines, delimiter=delimiter, comments=comments,
+                               ndmin=2)
+            lines = []
+            if block.size == 0:
+                continue
+            if names is None: # a header that doesn't fit is just a comment
+                if header is not None and len(header) == block.shape[1]:
+                    names = header
+                else:
+                    names = [str(k) for k in range(block.shape[1])]
+            data = {name: block[:,k] for k, name in enumerate(names)}
+            yield _named(data, names, columns)
+            pass
+    return
+
+def _named(data, names, columns):
+    """Add the kernel input names to a chunk's columns."""
+    for k, name in enumerate(_columns):
+        key = columns.get(name, name)
+        if isinstance(key, int):
+            key = names[key]
+        if key not in data:
+            if name == 'theta':
+                continue
+            if name not in columns and k < len(names):
+                key = names[k] # positional default
+            else:
+                raise KeyError(f"collision log has no column for {name} ({key})")
+        data[name] = data[key]
+        pass
+    return data
+
+def score_chunk(chunk, scaling='METAL15', nom=False, qsd_method=None, jit=False):
+    """Apply the impact scaling kernels to one chunk of a collision log.
+
+    Returns a dict of arrays: dl and MLR from gdc.disruption_level and, if
+    qsd_method is given, QsD, the target's Q*D from psci_helpers.Q_star_D
+    (evaluated without its range checks), and Q, the specific impact energy
+    0.5*m/M*v^2.
+    """
+
+    R, MRHO, r, mrho, v = (chunk[name] for name in _columns[:5])
+    theta = chunk.get('theta', np.pi/4)
+    dl, MLR = gdc.disruption_level(R, MRHO, r, mrho, v, theta, scaling, nom,
+                                   mlr=True, jit=jit)
+    out = dict(dl=np.atleast_1d(dl), MLR=np.atleast_1d(MLR))
+    if qsd_method is not None:
+        import psci_helpers
+        M, m = gdc._masses(R, MRHO, r, mrho)
+        out['QsD'] = np.atleast_1d(psci_helpers.Q_star_D(R, qsd_method, v=v,
+                                                         check=False))
+        out['Q'] = 0.5*m/M*v**2
+    return out
+
+def _score_job(job):
+    chunk, kwargs = job
+    return score_chunk(chunk, **kwargs)
+
+def process_log(path, out=None, chunksize=10**6, processes=1, bins=None,
+                read_kwargs=None, **kwargs):
+    """Score a collision log of any size in bounded memory.
+
+    The log is read with read_chunks and each chunk is scored with score_chunk
+    (kwargs are passed on: scaling, nom, qsd_method, jit). The per-collision
+    results are appended to the text file out, if given, as each chunk is
+    done, and a running summary is kept. With processes > 1 chunks are scored
+    in a process pool, with at most 2*processes chunks in flight, and are still
+    written in log order.
+
+    Parameters
+    ----------
+    path : str
+        Collision log (see read_chunks).
+    out : str, (optional)
+        Text file for the per-collision results (columns dl, MLR[, QsD, Q]).
+    chunksize : int, (optional)
+        Rows per chunk.
+    processes : int, (optional)
+        Number of worker processes (default 1, score in this process).
+    bins : array, (optional)
+        Bin edges in log10(dl) for the summary histogram (default -4 to 2 in
+        steps of 0.1).
+    read_kwargs : dict, (optional)
+        Extra arguments for read_chunks (columns, delimiter, comments).
+
+    Returns
+    -------
+    summary : dict
+        n (collisions scored), catastrophic (number with dl >= 1), dl_min,
+        dl_max, mass_lost (sum of (M + m) - MLR over collisions), bins and
+        hist (counts of log10(dl) in bins, with out-of-range values clipped to
+        the end bins).
+    """
+
+    if bins is None:
+        bins = np.linspace(-4, 2, 61)
+    summary = dict(n=0, catastrophic=0, dl_min=np.inf, dl_max=-np.inf,
+                   mass_lost=0.0, bins=bins, hist=np.zeros(len(bins) - 1, int))
+    chunks = read_chunks(path, chunksize, **(read_kwargs or {}))
+
+    fout = open(out, 'w') if out is not None else None
+    try:
+        header = True
+        for chunk, res in _scored(chunks, processes, kwargs):
+            M, m = gdc._masses(chunk['R'], chunk['MRHO'], chunk['r'], chunk['mrho'])
+            dl = res['dl']
+            summary['n'] += dl.size
+            summary['catastrophic'] += int(np.count_nonzero(dl >= 1))
+            summary['dl_min'] = min(summary['dl_min'], float(dl.min()))
+            summary['dl_max'] = max(summary['dl_max'], float(dl.max()))
+            summary['mass_lost'] += float(np.sum(M + m - res['MLR']))
+            with np.errstate(divide='ignore'):
+                ldl = np.clip(np.log10(dl), bins[0], bins[-1])
+            summary['hist'] += np.histogram(ldl, bins)[0]
+            if fout is not None:
+                np.savetxt(fout, np.column_stack(list(res.values())),
+                           header=' '.join(res) if header else '')
+                header = False
+            pass
+    finally:
+        if fout is not None:
+            fout.close()
+
+    return summary
+
+def _scored(chunks, processes, kwargs):
+    """Yield (chunk, score_chunk(chunk)) in order, optionally from a pool."""
+    if processes == 1:
+        for chunk in chunks:
+            yield chunk, score_chunk(chunk, **kwargs)
+            pass
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(int(processes)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(_score_job, (chunk, kwargs))))
+            if len(pending) >= 2*processes:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+            pass
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+            pass
+    return
+
+def _test():
+    import tempfile, pathlib
+    # Minimal assertions
+    rng = np.random.default_rng(0)
+    n = 2500
+    R = 10**rng.uniform(4, 6, n)
+    log = np.column_stack([R, rng.uniform(900, 3500, n), 0.3*R,
+                           np.full(n, 1000.0), rng.uniform(10, 8000, n)])
+    dl = gdc.disruption_level(*log.T)
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'log.txt')
+        np.savetxt(fname, log, header='R MRHO r mrho v')
+        np.save(os.path.join(tmp, 'log.npy'), log)
+        s1 = process_log(fname, os.path.join(tmp, 'out.txt'), chunksize=1000)
+        s2 = process_log(os.path.join(tmp, 'log.npy'), chunksize=700, processes=2)
+        assert np.allclose(np.loadtxt(os.path.join(tmp, 'out.txt'))[:,0], dl)
+        for header in ('run 42', 'a b c d e f g'):
+            np.savetxt(fname, log, header=header)
+            s3 = process_log(pathlib.Path(fname), chunksize=1000)
+            assert s3['n'] == n and s3['catastrophic'] == s1['catastrophic']
+    assert s1['n'] == s2['n'] == n and s1['hist'].sum() == n
+    assert s1['catastrophic'] == s2['catastrophic'] == np.count_nonzero(dl >= 1)
+    print("collision_log: all tests passed")
+    pass
+
+if __name__ == "__main__":
+    _test()
+    pass
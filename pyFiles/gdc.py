@@ -5,9 +5,11 @@
 # Author: Naor Movshovitz (nmovshov at gee mail dot com)
 #---------------------------------------------------------------------------------
 import sys, os, shutil
+import functools
 import numpy as np
 
-def disruption_level(R,MRHO,r,mrho,v,theta=np.pi/4,scaling='metal15',nom=False):
+def disruption_level(R,MRHO,r,mrho,v,theta=np.pi/4,scaling='metal15',nom=False,
+                     mlr=False,jit=False):
     """Return predicted level of disruption in gravity-dominated impact.
 
     This function returns the predicted level of disruption in a collision between
@@ -22,20 +24,24 @@ def disruption_level(R,MRHO,r,mrho,v,theta=np.pi/4,scaling='metal15',nom=False):
     greater than or equal to one indicates catastrophic disruption, but this is a
     convenient reference not a strict definition.
 
+    All numeric inputs may be arrays, which are broadcast against each other, so
+    a whole collision log is scored in one call. The mass-or-density choice and
+    the branches of each scaling law are applied element-wise with masks.
+
     Parameters
     ----------
-    R : numeric, scalar
+    R : numeric, scalar or array
         Target radius.
-    MRHO : numeric, scalar
+    MRHO : numeric, scalar or array
         Mass (if > 10^6) or mean density of target.
-    r : numeric, scalar
+    r : numeric, scalar or array
         Projectile radius.
-    mrho : numeric, scalar
+    mrho : numeric, scalar or array
         Mass (if > 10^6) or mean density of projectile.
-    v : numeric, scalar
+    v : numeric, scalar or array
         Impact speed.
-    theta : numeric, scalar (optional)
-        Impact angle (default pi/4).
+    theta : numeric, scalar or array (optional)
+        Impact angle, in [0,pi/2) (default pi/4).
     scaling : string (optional)
         Choice of scaling law. Supported scaling laws are:
         'METAL15' uses the K/U scaling suggested in Movshovitz et al. (2015)
@@ -49,15 +55,178 @@ def disruption_level(R,MRHO,r,mrho,v,theta=np.pi/4,scaling='metal15',nom=False):
         When nom=True the returned disruption level is always K/(Cnom*U) with Cnom
         a nominal mid-point value. This parameter has no effect when a scaling
         other than 'METAL15' is specified.
+    mlr : bool, (optional)
+        If True also return the predicted mass of the largest remnant,
+        MLR = (M + m)*(1 - dl/2).
+    jit : bool, (optional)
+        If True evaluate with a numba-compiled element-wise kernel (requires
+        numba) instead of whole-array numpy expressions; this avoids the
+        temporaries and is several times faster on large arrays.
     """
-    print scaling
-    pass
+
+    method = _scalings.get(scaling.upper())
+    if method is None:
+        raise ValueError(
+            "Unknown scaling method. Use one of: [METAL15 | LS12 | BA99].")
+    R, MRHO, r, mrho, v, theta = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (R, MRHO, r, mrho, v, theta)))
+    assert np.all((theta >= 0) & (theta < np.pi/2)), \
+        "Specify impact angle theta in [0,pi/2)."
+
+    if jit:
+        dl = _jit_kernel()(R, MRHO, r, mrho, v, theta, method, bool(nom))
+    else:
+        M, m = _masses(R, MRHO, r, mrho)
+        if method == 0:
+            dl = _metal15(R, M, r, m, v, theta, _bigG, nom)
+        elif method == 1:
+            dl = _ls12(R, M, r, m, v, theta, _bigG)
+        else:
+            dl = _ba99(R, M, m, v)
+
+    dl = dl[()]
+    if mlr:
+        M, m = _masses(R, MRHO, r, mrho)
+        return dl, ((M + m)*(1 - 0.5*dl))[()]
+    return dl
+
+_bigG = 6.674e-11
+_scalings = {'METAL15': 0, 'LS12': 1, 'BA99': 2}
+
+def _masses(R, MRHO, r, mrho):
+    # Mass-or-density determined by numeric value (assume SI units)
+    M = np.where(MRHO > 1e6, MRHO, 4*np.pi/3*MRHO*R**3)
+    m = np.where(mrho > 1e6, mrho, 4*np.pi/3*mrho*r**3)
+    return M, m
+
+def _interacting_fraction(R, r, theta):
+    # Fraction of projectile mass geometrically overlapping the target
+    el = (R + r)*(1 - np.sin(theta))
+    return np.where(el < 2*r, (3*r*el**2 - el**3)/(4*r**3), 1.0)
+
+def _metal15(R, M, r, m, v, theta, G, nominal):
+    """Disruption level according to Movshovitz et al. (2015) scaling."""
+    U = 3/5*G*M**2/R + 3/5*G*m**2/r + G*M*m/(R + r)
+    mu = M*m/(M + m)
+    K = 0.5*mu*v**2
+    malpha = _interacting_fraction(R, r, theta)
+    K_alpha = (malpha*M + m)/(M + m)*K
+
+    # Threshold impact energy depends on impact angle; division to angle bins is
+    # somewhat arbitrary and is likely to change when more simulation data becomes
+    # available.
+    Clo = 2.6; Chi = 8.4; Cnom = 0.5*(Clo + Chi)
+    if nominal:
+        Clo = Cnom; Chi = Cnom
+    f = np.where(theta < np.pi/6, 1.0, np.where(theta < np.pi/4, 2.0, 3.5))
+    Kstar_lo = f*Clo*U
+    Kstar_hi = f*Chi*U
+
+    dl = np.where(K_alpha > Kstar_hi, K_alpha/Kstar_hi, 1.0)
+    dl = np.where(K_alpha < Kstar_lo, K_alpha/Kstar_lo, dl)
+    return dl
+
+def _ls12(R, M, r, m, v, theta, G):
+    """Disruption level according to Leinhardt & Stewart (2012) scaling."""
+    # Calculate reduced interacting mass
+    malpha = _interacting_fraction(R, r, theta)
+    mu = M*m/(M + m)
+    mu_alpha = (M*m*malpha)/(M + m*malpha) # this is wrong
+
+    # Calculate Q'*_RD
+    rho1 = 1000
+    R_c1 = ((M + m)/(4*np.pi/3*rho1))**(1/3)
+    c_star = 1.9
+    Q_srdge1 = c_star*4/5*np.pi*rho1*G*R_c1**2
+    mu_bar = 0.36 # LS12 and SL12
+    mgamma = m/M
+    Q_star_RD = Q_srdge1*(0.25*(mgamma + 1)**2/mgamma)**(2/(3*mu_bar) - 1)
+    Q_prime_star_RD = Q_star_RD*(mu/mu_alpha)**(2 - 3*mu_bar/2) # this is wrong
+
+    # Compare to Q_RD
+    Q_R = 0.5*mu*v**2/(M + m)
+    fb = 1 - 0.5*Q_R/Q_prime_star_RD
+    eta = -1.5
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fb = np.where(fb < 0.1, (0.1/1.8**eta)*(Q_R/Q_prime_star_RD)**eta, fb)
+    return 2*(1 - fb)
+
+def _ba99(R, M, m, v):
+    """Disruption level according to Benz & Asphaug (1999) scaling."""
+    # Target density determines scaling-law parameters (ice below 2000 kg/m^3)
+    rho = M/(4*np.pi/3*R**3)
+    ice = rho < 2000
+    B = np.where(ice, 1.2e-7, 0.5e-7)
+    b = np.where(ice, 1.26, 1.36)
+
+    # Equation 6 in BA99
+    QsD = B*rho*(R*100)**b
+
+    # Compare with specific impact energy
+    Q = 0.5*m/M*v**2
+    return Q/QsD
+
+@functools.lru_cache(maxsize=None)
+def _jit_kernel():
+    """Compile (once) the element-wise numba kernel used with jit=True."""
+    import numba
+
+    @numba.vectorize(['float64(float64, float64, float64, float64, float64, '
+                      'float64, int64, boolean)'], nopython=True)
+    def kernel(R, MRHO, r, mrho, v, theta, method, nominal):
+        M = MRHO if MRHO > 1e6 else 4*np.pi/3*MRHO*R**3
+        m = mrho if mrho > 1e6 else 4*np.pi/3*mrho*r**3
+        if method == 2: # BA99
+            rho = M/(4*np.pi/3*R**3)
+            if rho < 2000:
+                B = 1.2e-7; b = 1.26
+            else:
+                B = 0.5e-7; b = 1.36
+            return 0.5*m/M*v**2/(B*rho*(R*100)**b)
+        el = (R + r)*(1 - np.sin(theta))
+        malpha = (3*r*el**2 - el**3)/(4*r**3) if el < 2*r else 1.0
+        mu = M*m/(M + m)
+        if method == 0: # METAL15
+            U = 3/5*_bigG*M**2/R + 3/5*_bigG*m**2/r + _bigG*M*m/(R + r)
+            K_alpha = (malpha*M + m)/(M + m)*0.5*mu*v**2
+            Clo = 2.6; Chi = 8.4
+            if nominal:
+                Clo = 0.5*(2.6 + 8.4); Chi = Clo
+            f = 1.0 if theta < np.pi/6 else (2.0 if theta < np.pi/4 else 3.5)
+            if K_alpha > f*Chi*U:
+                return K_alpha/(f*Chi*U)
+            if K_alpha < f*Clo*U:
+                return K_alpha/(f*Clo*U)
+            return 1.0
+        # LS12
+        mu_alpha = (M*m*malpha)/(M + m*malpha)
+        R_c1 = ((M + m)/(4*np.pi/3*1000))**(1/3)
+        Q_star_RD = (1.9*4/5*np.pi*1000*_bigG*R_c1**2*
+                     (0.25*(m/M + 1)**2/(m/M))**(2/(3*0.36) - 1))
+        Q_prime_star_RD = Q_star_RD*(mu/mu_alpha)**(2 - 3*0.36/2)
+        Q_R = 0.5*mu*v**2/(M + m)
+        fb = 1 - 0.5*Q_R/Q_prime_star_RD
+        if fb < 0.1:
+            fb = (0.1/1.8**-1.5)*(Q_R/Q_prime_star_RD)**-1.5
+        return 2*(1 - fb)
+
+    return kernel
 
 def _test():
-    print "alo world"
-    disruption_level(1,2,3,4,5,6)
+    # Minimal assertions
+    R, r = 1e5, 2e4
+    for scaling in ('METAL15', 'LS12', 'BA99'):
+        dl = disruption_level(R, 1000, r, 1000, [100, 1000, 5000], scaling=scaling)
+        assert np.all(np.diff(dl) > 0), scaling
+        assert np.allclose(dl, disruption_level(R, 1000, r, 1000, [100, 1000, 5000],
+                                                scaling=scaling, jit=True))
+        pass
+    M = 4*np.pi/3*1000*R**3
+    assert (disruption_level(R, M, r, 1000, 1e3) ==
+            disruption_level(R, 1000, r, 1000, 1e3))
+    print("gdc: all tests passed")
     pass
 
 if __name__ == "__main__":
     _test()
-    pass
\ No newline at end of file
+    pass
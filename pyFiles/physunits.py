@@ -16,25 +16,134 @@ quantity. It has two data attributes:
 But these details are never needed by the user, who defines their variables by
 multiplying a numeric value by one or more predefined class variables.
 
+Arrays of quantities that share a unit are represented by the `parray` type,
+which holds one ndarray of values and a single units vector. Multiplying a
+numpy array by a predefined unit gives a `parray`, and numpy ufuncs, common
+numpy functions (sum, mean, concatenate, ...), and the module's transcendental
+functions operate on it vectorized, with the dimension check done once per
+operation.
+
+Once a calculation has passed its dimensional checks the units can be stripped
+for production runs: with the environment variable PHYSUNITS_STRIP=1 set
+before import, or inside a `with strip_units():` block, the predefined units
+and constants are plain floats (their SI values) and the transcendental
+functions are numpy's, so the same code runs at native speed. Use
+check_modes() to verify that a calculation gives the same numbers both ways.
+
+Unit strings such as "km/s" or "g/cm^3" are parsed by parse_units(), and
+columns of numbers labeled with them are converted with to_si(), from_si() and
+convert(); units_label() gives the SI label in the format preal prints.
+
 Reference:
 Petty, G.W., 2001. Automated computation and consistency checking of physical
 dimensions and units in scientific programs. _Software: Practice and
 Experience_, 31(11), pp.1067-1076.
 """
+import os
+import re
+import contextlib
+import functools
 import numpy as np
 
 _nbdim = 6
 _dim_labels=['m','kg','s','K','A','mol']
 
+### Packed representation of units
+# The powers of the base dimensions are stored in a single python int: power k
+# of base dimension i is held as the integer k*_dim_scale in a field of width
+# _dim_base (balanced, so negative powers need no bias). Multiplying quantities
+# adds their packed ints, dividing subtracts them, and dimension checks are a
+# single int comparison; a dimensionless quantity has packed units 0. Powers
+# must be multiples of 1/_dim_scale (this covers all fractions with
+# denominators up to 10) and smaller than ~3000 in magnitude. Fields are kept
+# within a quarter of _dim_base, so a sum or difference of two valid packed
+# ints never carries between fields, and _dims_ok finds any field that left
+# the valid range with one add and one mask.
+_dim_scale = 2520
+_dim_base = 2**25
+_dim_bias = sum((_dim_base//4)*_dim_base**k for k in range(_nbdim))
+_dim_mask = sum((_dim_base//2)*_dim_base**k for k in range(_nbdim + 1))
+
+def _dims_ok(dims):
+    """Return dims if all its fields hold supported powers, else raise."""
+    if (dims + _dim_bias) & _dim_mask:
+        raise ValueError("unsupported power of base dimension (too large)")
+    return dims
+
+def _pack(units):
+    """Return the packed int for a sequence of _nbdim powers."""
+    dims = 0
+    for k, u in enumerate(units):
+        q = u*_dim_scale
+        n = int(round(q))
+        if abs(q - n) > 1e-6 or 4*abs(n) >= _dim_base:
+            raise ValueError(f"unsupported power of base dimension: {u}")
+        dims += n*_dim_base**k
+    return dims
+
+@functools.lru_cache(maxsize=None)
+def _unpack(dims):
+    """Return the tuple of _nbdim powers held in a packed int."""
+    units = []
+    for k in range(_nbdim):
+        n = (dims + _dim_base//2) % _dim_base - _dim_base//2
+        units.append(n/_dim_scale)
+        dims = (dims - n)//_dim_base
+    return tuple(units)
+
+@functools.lru_cache(maxsize=1024)
+def _dims_pow(dims, p):
+    """Return the packed units of a quantity with packed units dims to power p."""
+    return _pack([u*p for u in _unpack(dims)])
+
+@functools.lru_cache(maxsize=1024)
+def _units_str(dims):
+    """Return the label of packed units, e.g. " kg m^-3" (note leading space)."""
+    units = _unpack(dims)
+    s = ""
+    for k in range(len(_dim_labels)):
+        if np.abs(units[k]) < 0.1:
+            continue
+        if units[k] < 0:
+            continue
+        if np.isclose(units[k], 1.0):
+            s = s + f" {_dim_labels[k]}"
+        else:
+            s = s + f" {_dim_labels[k]}^{units[k]:g}"
+    for k in range(len(_dim_labels)):
+        if np.abs(units[k]) < 0.1:
+            continue
+        if units[k] > 0:
+            continue
+        else:
+            s = s + f" {_dim_labels[k]}^{units[k]:g}"
+    return s
+
+def _new_preal(value, dims):
+    """Make a preal from a numeric value and packed units, skipping checks."""
+    if type(value) is not np.float64:
+        value = np.float64(0.0) + value
+    p = object.__new__(preal)
+    p.value = value
+    p._dims = dims
+    return p
+
+def _mismatch():
+    return ValueError("Dimension mismatch, check your units!")
+
+_scalars = (int, float, complex, np.number)
+_arrays = (np.ndarray, list, tuple)
+
 class preal:
     """A dimensioned physical quantity.
 
     A variable of type `preal` represents a physical quantity using two
     data attributes:
 
-    self.value is a scalar of type float64 representing the numerical value.
+    self.value is a scalar (float, or numpy float64) representing the numerical
+    value.
 
-    self.units is an ndarray with shape=(5,) and dtype=float64, representing
+    self.units is an ndarray with shape=(6,) and dtype=float64, representing
     powers of base dimensions of the quantity, using the format:
       [length, mass, time, temperature, electric current, amount of matter]
 
@@ -42,14 +151,22 @@ class preal:
     because no one really knows what these are supposed to be.
 
     Note that self.units has dtype=float64 for simplicity but in practice will
-    hold values that are ratios of small integers.
+    hold values that are ratios of small integers. Internally the units are
+    kept packed in a single int (see _pack) so that arithmetic and dimension
+    checks cost about as much as a few float operations; self.units unpacks
+    them on access. This limits the powers to multiples of 1/2520 (fractions
+    with denominators up to 10) of magnitude up to about 3000; an operation
+    producing any other power (e.g. meter**(1/11), or meter**3000*meter**3000)
+    raises ValueError.
     """
 
+    __slots__ = ('value', '_dims')
+
     ### PREAL CONSTRUCTOR
     def __init__(self, value=np.nan, units=np.zeros(_nbdim)):
         if type(value) is preal:
             self.value = value.value
-            self.units = value.units.copy()
+            self._dims = value._dims
         else:
             try:
                 self.value = np.float64(0.0) + value
@@ -58,10 +175,17 @@ class preal:
             try:
                 units = np.array(units, dtype=np.float64)
                 assert units.shape == (_nbdim,)
-                self.units = np.zeros(_nbdim) + units
+                self._dims = _pack(units)
             except:
                 raise ValueError(f"could not create base units from {units}")
 
+    @property
+    def units(self):
+        return np.array(_unpack(self._dims))
+    @units.setter
+    def units(self, units):
+        self._dims = _pack(units)
+
     ### PREAL ISAS
     def isreal(self):
         return np.isreal(self.value)
@@ -70,32 +194,15 @@ class preal:
     def isfinite(self):
         return np.isfinite(self.value)
     def isdimless(self):
-        return np.array_equal(self.units, np.zeros(_nbdim))
+        return self._dims == 0
 
     ### DISPLAY DUNDERS
     def __repr__(self):
         # return f"physunits.preal({self.value!r}, {self.units!r})"
         return self.__str__()
-    
+
     def __str__(self):
-        s = f"{self.value:0.4}"
-        for k in range(len(_dim_labels)):
-            if np.abs(self.units[k]) < 0.1:
-                continue
-            if self.units[k] < 0:
-                continue
-            if np.isclose(self.units[k], 1.0):
-                s = s + f" {_dim_labels[k]}"
-            else:
-                s = s + f" {_dim_labels[k]}^{self.units[k]:g}"
-        for k in range(len(_dim_labels)):
-            if np.abs(self.units[k]) < 0.1:
-                continue
-            if self.units[k] > 0:
-                continue
-            else:
-                s = s + f" {_dim_labels[k]}^{self.units[k]:g}"
-        return s
+        return f"{self.value:0.4}" + _units_str(self._dims)
 
     ### TYPE CAST DUNDERS
     def __int__(self):
@@ -107,120 +214,486 @@ class preal:
 
     ### BASIC UNARY DUNDERS
     def __abs__(self):
-        return preal(abs(self.value), self.units)
+        return _new_preal(abs(self.value), self._dims)
     def __neg__(self):
-        return preal(-self.value, self.units)
+        return _new_preal(-self.value, self._dims)
 
     ### PREAL ARITHMETIC OPERATIONS
+    # Each operation takes a fast path for preal or plain-number operands
+    # (plain numbers are dimensionless). Operations with arrays are handed over
+    # to parray. Defining __array_ufunc__ makes numpy call it for
+    # ndarray.__mul__(preal), np.sqrt(preal), etc. instead of building an object
+    # array of preals.
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        return parray.__array_ufunc__(self, ufunc, method, *inputs, **kwargs)
+
     def __add__(self, other):
-        other = preal(other)
-        if np.array_equal(self.units, other.units):
-            return preal(self.value + other.value, self.units)
-        else:
-            raise ValueError("Dimension mismatch, check your units!")
+        if type(other) is preal:
+            if self._dims == other._dims:
+                return _new_preal(self.value + other.value, self._dims)
+            raise _mismatch()
+        if isinstance(other, _scalars):
+            if self._dims == 0:
+                return _new_preal(self.value + other, 0)
+            raise _mismatch()
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self) + other
+        return NotImplemented
     def __radd__(self, other):
-        other = preal(other)
-        if np.array_equal(self.units, other.units):
-            return preal(self.value + other.value, self.units)
-        else:
-            raise ValueError("Dimension mismatch, check your units!")
+        if isinstance(other, _scalars):
+            if self._dims == 0:
+                return _new_preal(other + self.value, 0)
+            raise _mismatch()
+        if isinstance(other, _arrays):
+            return np.add(other, parray(self))
+        return NotImplemented
 
     def __sub__(self, other):
-        other = preal(other)
-        if np.array_equal(self.units, other.units):
-            return preal(self.value - other.value, self.units)
-        else:
-            raise ValueError("Dimension mismatch, check your units!")
+        if type(other) is preal:
+            if self._dims == other._dims:
+                return _new_preal(self.value - other.value, self._dims)
+            raise _mismatch()
+        if isinstance(other, _scalars):
+            if self._dims == 0:
+                return _new_preal(self.value - other, 0)
+            raise _mismatch()
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self) - other
+        return NotImplemented
     def __rsub__(self, other):
-        other = preal(other)
-        if np.array_equal(self.units, other.units):
-            return preal(other.value - self.value, self.units)
-        else:
-            raise ValueError("Dimension mismatch, check your units!")
+        if isinstance(other, _scalars):
+            if self._dims == 0:
+                return _new_preal(other - self.value, 0)
+            raise _mismatch()
+        if isinstance(other, _arrays):
+            return np.subtract(other, parray(self))
+        return NotImplemented
 
     def __mul__(self, other):
-        other = preal(other)
-        return preal(self.value*other.value, self.units + other.units)
+        if type(other) is preal:
+            return _new_preal(self.value*other.value,
+                              _dims_ok(self._dims + other._dims))
+        if isinstance(other, _scalars):
+            return _new_preal(self.value*other, self._dims)
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self)*other
+        return NotImplemented
     def __rmul__(self, other):
-        other = preal(other)
-        return preal(self.value*other.value, self.units + other.units)
+        if isinstance(other, _scalars):
+            return _new_preal(other*self.value, self._dims)
+        if isinstance(other, _arrays):
+            return np.multiply(other, parray(self))
+        return NotImplemented
 
     def __truediv__(self, other):
-        other = preal(other)
-        return preal(self.value/other.value, self.units - other.units)
+        if type(other) is preal:
+            return _new_preal(self.value/other.value,
+                              _dims_ok(self._dims - other._dims))
+        if isinstance(other, _scalars):
+            return _new_preal(self.value/other, self._dims)
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self)/other
+        return NotImplemented
     def __rtruediv__(self, other):
-        other = preal(other)
-        return preal(other.value/self.value, other.units - self.units)
+        if isinstance(other, _scalars):
+            return _new_preal(other/self.value, -self._dims)
+        if isinstance(other, _arrays):
+            return np.divide(other, parray(self))
+        return NotImplemented
 
     def __pow__(self, other):
+        if type(other) is preal:
+            if other._dims != 0:
+                raise _mismatch()
+            other = other.value
+        if isinstance(other, _scalars):
+            return _new_preal(self.value**other, _dims_pow(self._dims, other))
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self)**other
+        return NotImplemented
+    def __rpow__(self, other):
+        if self._dims != 0:
+            raise _mismatch()
+        if isinstance(other, _scalars):
+            return _new_preal(other**self.value, 0)
+        if isinstance(other, _arrays):
+            return np.power(other, parray(self))
+        return NotImplemented
+
+    ### PREAL COMPARISONS
+    def __lt__(self, other):
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self) < other
         other = preal(other)
-        if other.isdimless():
-            return preal(self.value**other.value, self.units*other.value)
+        if self._dims == other._dims:
+            return self.value < other.value
         else:
-            raise ValueError("Dimension mismatch, check your units!")
-    def __rpow__(self, other):
+            raise _mismatch()
+    def __le__(self, other):
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self) <= other
+        other = preal(other)
+        if self._dims == other._dims:
+            return self.value <= other.value
+        else:
+            raise _mismatch()
+    def __gt__(self, other):
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self) > other
+        other = preal(other)
+        if self._dims == other._dims:
+            return self.value > other.value
+        else:
+            raise _mismatch()
+    def __ge__(self, other):
+        if isinstance(other, (np.ndarray, list, tuple, parray)):
+            return parray(self) >= other
         other = preal(other)
-        if self.isdimless():
-            return preal(other.value**self.value, other.units*self.value)
+        if self._dims == other._dims:
+            return self.value >= other.value
+        else:
+            raise _mismatch()
+
+### ARRAY-VALUED QUANTITIES
+def _value_of(x):
+    return x.value if isinstance(x, (preal, parray)) else x
+def _dims_of(x):
+    return x._dims if isinstance(x, (preal, parray)) else 0
+
+def _same_dims(dims):
+    """Return the common packed units of a sequence, or raise ValueError."""
+    for d in dims[1:]:
+        if d != dims[0]:
+            raise _mismatch()
+    return dims[0]
+
+def _wrap(value, dims):
+    """Return preal for a scalar value and parray otherwise."""
+    if np.ndim(value) == 0:
+        return _new_preal(value, dims)
+    return _new_parray(value, dims)
+
+def _new_parray(value, dims):
+    """Make a parray from an ndarray and packed units, skipping checks."""
+    p = object.__new__(parray)
+    p.value = value
+    p._dims = dims
+    return p
+
+class parray(np.lib.mixins.NDArrayOperatorsMixin):
+    """An array of dimensioned physical quantities sharing one unit.
+
+    A variable of type `parray` represents an array of physical quantities of
+    the same kind using two data attributes:
+
+    self.value is an ndarray (of dtype float64 unless given a float or complex
+    array) holding the numerical values.
+
+    self.units is a single ndarray with shape=(6,) in the same format as
+    preal.units (and, like it, held packed internally).
+
+    Arithmetic operators map to numpy ufuncs, and ufuncs and common numpy
+    functions are intercepted by __array_ufunc__ and __array_function__. The
+    numerical work is done on the whole value array while the units are
+    checked and combined once per operation. Indexing a single element, or a
+    full reduction, returns a preal. The easiest way to make a parray is to
+    multiply a numpy array by a predefined unit, e.g. np.linspace(0,1)*meter.
+    """
+
+    __slots__ = ('value', '_dims')
+
+    ### PARRAY CONSTRUCTOR
+    def __init__(self, value=np.nan, units=np.zeros(_nbdim)):
+        dims = None
+        if isinstance(value, (preal, parray)):
+            dims = value._dims
+            value = value.value
+        elif (isinstance(value, (list, tuple)) and len(value) > 0 and
+              all(isinstance(v, preal) for v in value)):
+            dims = _same_dims([v._dims for v in value])
+            value = [v.value for v in value]
+        try:
+            value = np.asarray(value)
+            if not np.issubdtype(value.dtype, np.inexact):
+                value = value.astype(np.float64)
+            self.value = value
+        except:
+            raise ValueError(f"could not create parray value from {value}")
+        if dims is not None:
+            self._dims = dims
+            return
+        try:
+            units = np.array(units, dtype=np.float64)
+            assert units.shape == (_nbdim,)
+            self._dims = _pack(units)
+        except:
+            raise ValueError(f"could not create base units from {units}")
+
+    @property
+    def units(self):
+        return np.array(_unpack(self._dims))
+    @units.setter
+    def units(self, units):
+        self._dims = _pack(units)
+
+    ### PARRAY ISAS
+    def isreal(self):
+        return np.isreal(self.value)
+    def isinf(self):
+        return np.isinf(self.value)
+    def isfinite(self):
+        return np.isfinite(self.value)
+    def isdimless(self):
+        return self._dims == 0
+
+    ### ARRAY ATTRIBUTES AND CONTAINER DUNDERS
+    @property
+    def shape(self):
+        return self.value.shape
+    @property
+    def ndim(self):
+        return self.value.ndim
+    @property
+    def size(self):
+        return self.value.size
+    @property
+    def dtype(self):
+        return self.value.dtype
+    @property
+    def T(self):
+        return _new_parray(self.value.T, self._dims)
+
+    def __len__(self):
+        return len(self.value)
+    def __getitem__(self, key):
+        return _wrap(self.value[key], self._dims)
+    def __setitem__(self, key, item):
+        _same_dims([self._dims, _dims_of(item)])
+        self.value[key] = _value_of(item)
+    def __iter__(self):
+        for v in self.value:
+            yield _wrap(v, self._dims)
+
+    ### DISPLAY DUNDERS
+    def __repr__(self):
+        return self.__str__()
+    def __str__(self):
+        return np.array2string(self.value, precision=4) + _units_str(self._dims)
+
+    ### CONVENIENCE METHODS (see __array_function__)
+    def sum(self, *args, **kwargs):
+        return np.sum(self, *args, **kwargs)
+    def mean(self, *args, **kwargs):
+        return np.mean(self, *args, **kwargs)
+    def std(self, *args, **kwargs):
+        return np.std(self, *args, **kwargs)
+    def var(self, *args, **kwargs):
+        return np.var(self, *args, **kwargs)
+    def min(self, *args, **kwargs):
+        return np.min(self, *args, **kwargs)
+    def max(self, *args, **kwargs):
+        return np.max(self, *args, **kwargs)
+    def cumsum(self, *args, **kwargs):
+        return np.cumsum(self, *args, **kwargs)
+    def argmin(self, *args, **kwargs):
+        return np.argmin(self.value, *args, **kwargs)
+    def argmax(self, *args, **kwargs):
+        return np.argmax(self.value, *args, **kwargs)
+    def reshape(self, *args, **kwargs):
+        return _new_parray(self.value.reshape(*args, **kwargs), self._dims)
+    def ravel(self):
+        return _new_parray(self.value.ravel(), self._dims)
+    def copy(self):
+        return _new_parray(self.value.copy(), self._dims)
+
+    ### NUMPY PROTOCOLS
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        dims = [_dims_of(x) for x in inputs]
+        inputs = [_value_of(x) for x in inputs]
+        out = kwargs.get('out', ())
+        if out:
+            kwargs['out'] = tuple(_value_of(x) for x in out)
+
+        if method in ('__call__', 'outer'):
+            rdims = _ufunc_dims(ufunc, inputs, dims)
+        elif method in ('reduce', 'accumulate', 'reduceat'):
+            if ufunc in (np.add, np.maximum, np.minimum, np.fmax, np.fmin):
+                rdims = dims[0]
+            else:
+                _same_dims([0, dims[0]])
+                rdims = None
+        else:
+            return NotImplemented
+
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if rdims is None:
+            return result
+        if out and isinstance(out[0], parray):
+            out[0]._dims = rdims
+            return out[0]
+        return _wrap(result, rdims)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func not in _HANDLED_FUNCTIONS:
+            return NotImplemented
+        if not all(issubclass(t, (parray, np.ndarray)) for t in types):
+            return NotImplemented
+        return _HANDLED_FUNCTIONS[func](*args, **kwargs)
+
+### Unit rules for numpy ufuncs acting on parray
+_UF_SAME = {np.add, np.subtract, np.maximum, np.minimum, np.fmax, np.fmin,
+            np.hypot, np.fmod, np.remainder}
+_UF_COMPARE = {np.equal, np.not_equal, np.less, np.less_equal, np.greater,
+               np.greater_equal, np.arctan2}
+_UF_KEEP = {np.negative, np.positive, np.absolute, np.fabs, np.conjugate,
+            np.rint, np.floor, np.ceil, np.trunc}
+_UF_ANY = {np.isfinite, np.isinf, np.isnan, np.signbit, np.sign}
+
+def _ufunc_dims(ufunc, inputs, dims):
+    """Check operand units of ufunc and return result units (None=plain)."""
+    if ufunc in _UF_SAME:
+        return _same_dims(dims)
+    if ufunc in _UF_KEEP:
+        return dims[0]
+    if ufunc in _UF_COMPARE:
+        _same_dims(dims)
+        return None
+    if ufunc in _UF_ANY:
+        return None
+    if ufunc in (np.multiply, np.matmul):
+        return _dims_ok(dims[0] + dims[1])
+    if ufunc in (np.divide, np.floor_divide):
+        return _dims_ok(dims[0] - dims[1])
+    if ufunc is np.reciprocal:
+        return -dims[0]
+    if ufunc is np.sqrt:
+        return _dims_pow(dims[0], 0.5)
+    if ufunc is np.cbrt:
+        return _dims_pow(dims[0], 1/3)
+    if ufunc is np.square:
+        return 2*dims[0]
+    if ufunc in (np.power, np.float_power):
+        _same_dims([0, dims[1]])
+        p = np.unique(inputs[1])
+        if p.size != 1:
+            raise ValueError("Exponent of dimensioned array must be a scalar.")
+        return _dims_pow(dims[0], p[0].item())
+    # Anything else (sin, exp, log, ...) takes dimensionless input
+    if any(d != 0 for d in dims):
+        raise ValueError(f"{ufunc.__name__} takes dimensionless input.")
+    return None
+
+### Numpy functions implemented for parray
+_HANDLED_FUNCTIONS = {}
+
+def _implements(*funcs):
+    def decorator(impl):
+        for f in funcs:
+            _HANDLED_FUNCTIONS[f] = impl
+        return impl
+    return decorator
+
+def _keep_units(func):
+    def impl(a, *args, **kwargs):
+        return _wrap(func(_value_of(a), *args, **kwargs), _dims_of(a))
+    return impl
+
+def _no_units(func):
+    def impl(a, *args, **kwargs):
+        return func(_value_of(a), *args, **kwargs)
+    return impl
+
+def _squared_units(func):
+    def impl(a, *args, **kwargs):
+        return _wrap(func(_value_of(a), *args, **kwargs), 2*_dims_of(a))
+    return impl
+
+def _product_units(func):
+    def impl(a, b, *args, **kwargs):
+        return _wrap(func(_value_of(a), _value_of(b), *args, **kwargs),
+                     _dims_of(a) + _dims_of(b))
+    return impl
+
+def _joined_units(func):
+    def impl(arrays, *args, **kwargs):
+        dims = _same_dims([_dims_of(a) for a in arrays])
+        return _wrap(func([_value_of(a) for a in arrays], *args, **kwargs), dims)
+    return impl
+
+def _compared_units(func):
+    def impl(a, b, *args, **kwargs):
+        _same_dims([_dims_of(a), _dims_of(b)])
+        return func(_value_of(a), _value_of(b), *args, **kwargs)
+    return impl
+
+for _rule, _names in (
+    (_keep_units, ('sum', 'mean', 'median', 'std', 'min', 'max', 'amin', 'amax',
+                   'ptp', 'cumsum', 'diff', 'sort', 'round', 'around', 'copy',
+                   'reshape', 'ravel', 'transpose', 'squeeze', 'atleast_1d',
+                   'nansum', 'nanmean', 'nanmedian', 'nanstd', 'nanmin',
+                   'nanmax', 'percentile', 'quantile', 'flip', 'roll', 'repeat',
+                   'tile', 'take', 'broadcast_to', 'real', 'imag')),
+    (_no_units, ('argmin', 'argmax', 'argsort', 'shape', 'ndim', 'size',
+                 'nonzero', 'count_nonzero')),
+    (_squared_units, ('var', 'nanvar')),
+    (_product_units, ('dot', 'inner', 'outer')),
+    (_joined_units, ('concatenate', 'stack', 'vstack', 'hstack')),
+    (_compared_units, ('isclose', 'allclose', 'array_equal'))):
+    for _name in _names:
+        if hasattr(np, _name):
+            _HANDLED_FUNCTIONS[getattr(np, _name)] = _rule(getattr(np, _name))
+del _rule, _names, _name
+
+@_implements(np.where)
+def _where(condition, *xy):
+    if not xy:
+        return np.where(_value_of(condition))
+    dims = _same_dims([_dims_of(v) for v in xy])
+    return _wrap(np.where(condition, *[_value_of(v) for v in xy]), dims)
+
+@_implements(np.clip)
+def _clip(a, a_min=None, a_max=None, **kwargs):
+    _same_dims([_dims_of(a)] + [_dims_of(b) for b in (a_min, a_max)
+                                if b is not None])
+    return _wrap(np.clip(_value_of(a), _value_of(a_min), _value_of(a_max),
+                         **kwargs), _dims_of(a))
+
+@_implements(np.interp)
+def _interp(x, xp, fp, *args, **kwargs):
+    _same_dims([_dims_of(x), _dims_of(xp)])
+    return _wrap(np.interp(_value_of(x), _value_of(xp), _value_of(fp),
+                           *args, **kwargs), _dims_of(fp))
+
+### Transcendental functions overloaded for preal and parray
+def _dimless_value(p):
+    if isinstance(p, (preal, parray)):
+        if p.isdimless():
+            return p.value
         else:
-            raise ValueError("Dimension mismatch, check your units!")
+            raise ValueError("Transcendental function takes dimensionless input.")
+    return p
 
-### Transcendental functions overloaded for preal
 def cos(p):
-    p = preal(p)
-    if p.isdimless():
-        return np.cos(p.value)
-    else:
-        raise ValueError("Transcendental function takes dimensionless input.")
+    return np.cos(_dimless_value(p))
 def sin(p):
-    p = preal(p)
-    if p.isdimless():
-        return np.sin(p.value)
-    else:
-        raise ValueError("Transcendental function takes dimensionless input.")
+    return np.sin(_dimless_value(p))
 def tan(p):
-    p = preal(p)
-    if p.isdimless():
-        return np.tan(p.value)
-    else:
-        raise ValueError("Transcendental function takes dimensionless input.")
+    return np.tan(_dimless_value(p))
 def exp(p):
-    p = preal(p)
-    if p.isdimless():
-        return np.exp(p.value)
-    else:
-        raise ValueError("Transcendental function takes dimensionless input.")
+    return np.exp(_dimless_value(p))
 def log(p):
-    p = preal(p)
-    if p.isdimless():
-        return np.log(p.value)
-    else:
-        raise ValueError("Transcendental function takes dimensionless input.")
+    return np.log(_dimless_value(p))
 def log10(p):
-    p = preal(p)
-    if p.isdimless():
-        return np.log10(p.value)
-    else:
-        raise ValueError("Transcendental function takes dimensionless input.")
+    return np.log10(_dimless_value(p))
 
 ### Predefined interface variables ###
-# Base units
-meter    = preal(1,[1, 0, 0, 0, 0, 0])
-kilogram = preal(1,[0, 1, 0, 0, 0, 0])
-second   = preal(1,[0, 0, 1, 0, 0, 0])
-kelvin   = preal(1,[0, 0, 0, 1, 0, 0])
-ampere   = preal(1,[0, 0, 0, 0, 1, 0])
-mole     = preal(1,[0, 0, 0, 0, 0, 1])
-radian   = preal(1,[0, 0, 0, 0, 0, 0])
-
-# Abbreviations
-m   = meter
-kg  = kilogram
-s   = second
-K   = kelvin
-A   = ampere
-mol = mole
-rad = radian
+# The units and constants are resolved lazily: the first lookup of a name (as
+# physunits.newton or with from physunits import newton) builds the preal from
+# the table below and caches it as a module attribute, so importing the module
+# does no preal arithmetic. Each row is name: (SI value, powers of the base
+# units, definition), where the definition is the expression the row was
+# computed from (None for base units) and is re-checked by _check_table().
+# A string row is an alias of another name.
 
 # SI prefixes
 yotta = 1.0e+24
@@ -244,117 +717,473 @@ atto  = 1.0e-18
 zepto = 1.0e-21
 zocto = 1.0e-24
 
-# Basic derived units
-steradian = radian**2
-degree    = radian*np.pi/180
-hertz     = second**-1
-newton    = kilogram*meter/second**2
-pascal    = newton/meter**2
-joule     = newton*meter
-watt      = joule/second
-coulomb   = ampere*second
-volt      = joule/coulomb
-ohm       = volt/ampere
-tesla     = newton/ampere/meter
-gauss     = tesla/1e4
-
-# More abbreviations
-deg = degree
-Hz  = hertz
-N   = newton
-Pa  = pascal
-J   = joule
-W   = watt
-C   = coulomb
-V   = volt
-T   = tesla
-G   = gauss
-
-# Common physical constants
-# 2018 NIST reference <http://physics.nist.gov/cuu/index.html>
-speed_of_light      = 299792458*meter/second
-planck              = 6.62607015e-34*joule*second
-h_bar               = 1.054571817e-34*joule*second
-avogadro            = 6.02214076e+23/mole
-universal_gas       = 8.314462618*joule/(mole*kelvin)
-boltzmann           = 1.380649e-23*joule/kelvin
-electron_charge     = 1.602176634e-19*coulomb
-electron_rest_mass  = 9.1093837015e-31*kilogram
-proton_rest_mass    = 1.67262192369e-27*kilogram
-stefan_boltzmann    = 5.670374419e-8*watt*m**-2*kelvin**-4
-gravity             = 6.67430e-11*meter**3/(kilogram*second**2)
-
-
-# Selected astronomical constants
-# IAU, NSFA, and the Navy's almanac (http://asa.usno.navy.mil)
-solar_mass_parameter = 1.32712440041e20*meter**3*second**-2
-earth_mass_parameter = 3.986004356e14*meter**3/second**2
-astronomical_unit    = 149597870700*meter
-
-# Selected non-SI units of time
-minute        = 60.0*second
-hour          = 60.0*minute
-hr            = hour
-day           = 24.0*hour
-year          = 365.24*day
-yr            = year
-
-# Selected non-SI units of length
-angstrom          = 1.0e-10*meter
-micrometer        = micro*meter
-micron            = micrometer
-millimeter        = milli*meter
-mm                = millimeter
-centimeter        = centi*meter
-cm                = centimeter
-kilometer         = kilo*meter
-km                = kilometer
-inch              = 2.54*centimeter
-foot              = 12.0*inch
-yard              = 3.0*foot
-statute_mile      = 5280.0*foot
-mile              = statute_mile
-light_year        = speed_of_light*year
-parsec            = 3.085680e+16*meter
-pc                = parsec
-
-# Selected non-SI units of volume
-liter              = 1.0e-3*meter**3
-cc                 = centimeter**3
-imperial_gallon_uk = 4.54609*liter
-
-# Selected non-SI units of linear velocity
-kilometer_per_hour = kilometer/hour
-kph                = kilometer_per_hour
-
-# Selected non-SI units of mass
-gram                 = kilogram/kilo
-g                    = gram
-atomic_mass_unit     = 1.0e-3*kilogram/(avogadro*mole)
-amu                  = atomic_mass_unit
-slug                 = 1.459390e+1*kilogram
-solar_mass           = 1.9884e+30*kilogram
-earth_mass           = 5.9722e+24*kilogram
-
-# Selected non-SI units of force
-dyne = 1.0e-5*newton
-
-# Selected non-SI units of pressure
-bar          = 1.0e+5*pascal
-millibar     = milli*bar
-mbar         = millibar
-atmosphere   = 1.01325e+5*pascal
-atm          = atmosphere
-millimeterHg = 133.322*pascal
-mmHg         = millimeterHg
-GPa          = giga*pascal
-
-# Selected non-SI units of energy
-electronvolt = electron_charge*volt
-eV           = electronvolt
-erg          = 1.0e-7*joule
-btu          = 1055.05585*joule
-calorie      = 4.184*joule
-gram_tnt     = 1000*calorie
-ton_tnt      = 1e6*gram_tnt
-kiloton_tnt  = 1000*ton_tnt
+_table = {
+    # Base units
+    'meter':    (1.0, (1, 0, 0, 0, 0, 0), None),
+    'kilogram': (1.0, (0, 1, 0, 0, 0, 0), None),
+    'second':   (1.0, (0, 0, 1, 0, 0, 0), None),
+    'kelvin':   (1.0, (0, 0, 0, 1, 0, 0), None),
+    'ampere':   (1.0, (0, 0, 0, 0, 1, 0), None),
+    'mole':     (1.0, (0, 0, 0, 0, 0, 1), None),
+    'radian':   (1.0, (0, 0, 0, 0, 0, 0), None),
+
+    # Abbreviations
+    'm':   'meter',
+    'kg':  'kilogram',
+    's':   'second',
+    'K':   'kelvin',
+    'A':   'ampere',
+    'mol': 'mole',
+    'rad': 'radian',
+
+    # Basic derived units
+    'steradian': (1.0,                  (0, 0, 0, 0, 0, 0), 'radian**2'),
+    'degree':    (0.017453292519943295, (0, 0, 0, 0, 0, 0), 'radian*np.pi/180'),
+    'hertz':     (1.0,                  (0, 0, -1, 0, 0, 0), 'second**-1'),
+    'newton':    (1.0,                  (1, 1, -2, 0, 0, 0),
+                  'kilogram*meter/second**2'),
+    'pascal':    (1.0,                  (-1, 1, -2, 0, 0, 0), 'newton/meter**2'),
+    'joule':     (1.0,                  (2, 1, -2, 0, 0, 0), 'newton*meter'),
+    'watt':      (1.0,                  (2, 1, -3, 0, 0, 0), 'joule/second'),
+    'coulomb':   (1.0,                  (0, 0, 1, 0, 1, 0), 'ampere*second'),
+    'volt':      (1.0,                  (2, 1, -3, 0, -1, 0), 'joule/coulomb'),
+    'ohm':       (1.0,                  (2, 1, -3, 0, -2, 0), 'volt/ampere'),
+    'tesla':     (1.0,                  (0, 1, -2, 0, -1, 0), 'newton/ampere/meter'),
+    'gauss':     (0.0001,               (0, 1, -2, 0, -1, 0), 'tesla/1e4'),
+
+    # More abbreviations
+    'deg': 'degree',
+    'Hz':  'hertz',
+    'N':   'newton',
+    'Pa':  'pascal',
+    'J':   'joule',
+    'W':   'watt',
+    'C':   'coulomb',
+    'V':   'volt',
+    'T':   'tesla',
+    'G':   'gauss',
+
+    # Common physical constants
+    # 2018 NIST reference <http://physics.nist.gov/cuu/index.html>
+    'speed_of_light':     (299792458.0,       (1, 0, -1, 0, 0, 0),
+                           '299792458*meter/second'),
+    'planck':             (6.62607015e-34,    (2, 1, -1, 0, 0, 0),
+                           '6.62607015e-34*joule*second'),
+    'h_bar':              (1.054571817e-34,   (2, 1, -1, 0, 0, 0),
+                           '1.054571817e-34*joule*second'),
+    'avogadro':           (6.02214076e+23,    (0, 0, 0, 0, 0, -1),
+                           '6.02214076e+23/mole'),
+    'universal_gas':      (8.314462618,       (2, 1, -2, -1, 0, -1),
+                           '8.314462618*joule/(mole*kelvin)'),
+    'boltzmann':          (1.380649e-23,      (2, 1, -2, -1, 0, 0),
+                           '1.380649e-23*joule/kelvin'),
+    'electron_charge':    (1.602176634e-19,   (0, 0, 1, 0, 1, 0),
+                           '1.602176634e-19*coulomb'),
+    'electron_rest_mass': (9.1093837015e-31,  (0, 1, 0, 0, 0, 0),
+                           '9.1093837015e-31*kilogram'),
+    'proton_rest_mass':   (1.67262192369e-27, (0, 1, 0, 0, 0, 0),
+                           '1.67262192369e-27*kilogram'),
+    'stefan_boltzmann':   (5.670374419e-08,   (0, 1, -3, -4, 0, 0),
+                           '5.670374419e-8*watt*m**-2*kelvin**-4'),
+    'gravity':            (6.6743e-11,        (3, -1, -2, 0, 0, 0),
+                           '6.67430e-11*meter**3/(kilogram*second**2)'),
+
+    # Selected astronomical constants
+    # IAU, NSFA, and the Navy's almanac (http://asa.usno.navy.mil)
+    'solar_mass_parameter': (1.32712440041e+20, (3, 0, -2, 0, 0, 0),
+                             '1.32712440041e20*meter**3*second**-2'),
+    'earth_mass_parameter': (398600435600000.0, (3, 0, -2, 0, 0, 0),
+                             '3.986004356e14*meter**3/second**2'),
+    'astronomical_unit':    (149597870700.0,    (1, 0, 0, 0, 0, 0),
+                             '149597870700*meter'),
+
+    # Selected non-SI units of time
+    'minute': (60.0,       (0, 0, 1, 0, 0, 0), '60.0*second'),
+    'hour':   (3600.0,     (0, 0, 1, 0, 0, 0), '60.0*minute'),
+    'hr':     'hour',
+    'day':    (86400.0,    (0, 0, 1, 0, 0, 0), '24.0*hour'),
+    'year':   (31556736.0, (0, 0, 1, 0, 0, 0), '365.24*day'),
+    'yr':     'year',
+
+    # Selected non-SI units of length
+    'angstrom':     (1e-10,                (1, 0, 0, 0, 0, 0), '1.0e-10*meter'),
+    'micrometer':   (1e-06,                (1, 0, 0, 0, 0, 0), 'micro*meter'),
+    'micron':       'micrometer',
+    'millimeter':   (0.001,                (1, 0, 0, 0, 0, 0), 'milli*meter'),
+    'mm':           'millimeter',
+    'centimeter':   (0.01,                 (1, 0, 0, 0, 0, 0), 'centi*meter'),
+    'cm':           'centimeter',
+    'kilometer':    (1000.0,               (1, 0, 0, 0, 0, 0), 'kilo*meter'),
+    'km':           'kilometer',
+    'inch':         (0.025400000000000002, (1, 0, 0, 0, 0, 0), '2.54*centimeter'),
+    'foot':         (0.3048,               (1, 0, 0, 0, 0, 0), '12.0*inch'),
+    'yard':         (0.9144000000000001,   (1, 0, 0, 0, 0, 0), '3.0*foot'),
+    'statute_mile': (1609.344,             (1, 0, 0, 0, 0, 0), '5280.0*foot'),
+    'mile':         'statute_mile',
+    'light_year':   (9460471451897088.0,   (1, 0, 0, 0, 0, 0),
+                     'speed_of_light*year'),
+    'parsec':       (3.08568e+16,          (1, 0, 0, 0, 0, 0), '3.085680e+16*meter'),
+    'pc':           'parsec',
+
+    # Selected non-SI units of volume
+    'liter':              (0.001,                  (3, 0, 0, 0, 0, 0),
+                           '1.0e-3*meter**3'),
+    'cc':                 (1.0000000000000002e-06, (3, 0, 0, 0, 0, 0),
+                           'centimeter**3'),
+    'imperial_gallon_uk': (0.004546090000000001,   (3, 0, 0, 0, 0, 0),
+                           '4.54609*liter'),
+
+    # Selected non-SI units of linear velocity
+    'kilometer_per_hour': (0.2777777777777778, (1, 0, -1, 0, 0, 0),
+                           'kilometer/hour'),
+    'kph':                'kilometer_per_hour',
+
+    # Selected non-SI units of mass
+    'gram':             (0.001,                  (0, 1, 0, 0, 0, 0),
+                         'kilogram/kilo'),
+    'g':                'gram',
+    'atomic_mass_unit': (1.6605390671738466e-27, (0, 1, 0, 0, 0, 0),
+                         '1.0e-3*kilogram/(avogadro*mole)'),
+    'amu':              'atomic_mass_unit',
+    'slug':             (14.5939,                (0, 1, 0, 0, 0, 0),
+                         '1.459390e+1*kilogram'),
+    'solar_mass':       (1.9884e+30,             (0, 1, 0, 0, 0, 0),
+                         '1.9884e+30*kilogram'),
+    'earth_mass':       (5.9722e+24,             (0, 1, 0, 0, 0, 0),
+                         '5.9722e+24*kilogram'),
+
+    # Selected non-SI units of force
+    'dyne': (1e-05, (1, 1, -2, 0, 0, 0), '1.0e-5*newton'),
+
+    # Selected non-SI units of pressure
+    'bar':          (100000.0,     (-1, 1, -2, 0, 0, 0), '1.0e+5*pascal'),
+    'millibar':     (100.0,        (-1, 1, -2, 0, 0, 0), 'milli*bar'),
+    'mbar':         'millibar',
+    'atmosphere':   (101325.0,     (-1, 1, -2, 0, 0, 0), '1.01325e+5*pascal'),
+    'atm':          'atmosphere',
+    'millimeterHg': (133.322,      (-1, 1, -2, 0, 0, 0), '133.322*pascal'),
+    'mmHg':         'millimeterHg',
+    'GPa':          (1000000000.0, (-1, 1, -2, 0, 0, 0), 'giga*pascal'),
+
+    # Selected non-SI units of energy
+    'electronvolt': (1.602176634e-19, (2, 1, -2, 0, 0, 0), 'electron_charge*volt'),
+    'eV':           'electronvolt',
+    'erg':          (1e-07,           (2, 1, -2, 0, 0, 0), '1.0e-7*joule'),
+    'btu':          (1055.05585,      (2, 1, -2, 0, 0, 0), '1055.05585*joule'),
+    'calorie':      (4.184,           (2, 1, -2, 0, 0, 0), '4.184*joule'),
+    'gram_tnt':     (4184.0,          (2, 1, -2, 0, 0, 0), '1000*calorie'),
+    'ton_tnt':      (4184000000.0,    (2, 1, -2, 0, 0, 0), '1e6*gram_tnt'),
+    'kiloton_tnt':  (4184000000000.0, (2, 1, -2, 0, 0, 0), '1000*ton_tnt'),
+}
+
+def _resolve(name):
+    """Build and cache the predefined quantity name (a float if stripped)."""
+    g = globals()
+    if name not in g:
+        row = _table[name]
+        if isinstance(row, str):
+            g[name] = _resolve(row)
+        elif _stripped:
+            g[name] = np.float64(row[0])
+        else:
+            g[name] = _new_preal(np.float64(row[0]), _pack(row[1]))
+    return g[name]
+
+def __getattr__(name):
+    if name not in _table:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _resolve(name)
+
+def __dir__():
+    return sorted(set(globals()) | set(_table))
+
+def _check_table():
+    """Re-evaluate the _table definitions and compare with the stored rows."""
+    ns = {name: _resolve(name) for name in _table}
+    ns.update(np=np, micro=micro, milli=milli, centi=centi, kilo=kilo, giga=giga)
+    for name, row in _table.items():
+        if isinstance(row, str):
+            assert row in _table, f"{name} is an alias of unknown unit {row}"
+            continue
+        value, units, definition = row
+        if definition is None:
+            continue
+        q = eval(definition, ns)
+        assert q._dims == _pack(units), f"wrong units for {name} in _table"
+        assert np.isclose(q.value, value, rtol=1e-15, atol=0), \
+            f"wrong value for {name} in _table"
+
+### Unit strings
+# Unit labels such as "km/s", "g/cm^3", "GPa" or " kg m^-3" (the format printed
+# by preal and parray) are parsed against _table. A name that is not in the
+# table may carry an SI prefix symbol (k, M, G, m, u, ...) or a full prefix
+# name (kilo, mega, ...). Juxtaposed factors multiply, powers are written with
+# ^ or ** and may be negative or fractional, e.g. m^(1/2). Each distinct string
+# is parsed once; after that a conversion is a cache lookup and one multiply.
+_prefixes = {'Y': yotta, 'Z': zetta, 'E': exa, 'P': peta, 'T': tera, 'G': giga,
+             'M': mega, 'k': kilo, 'h': hecto, 'da': deka, 'd': deci,
+             'c': centi, 'm': milli, 'u': micro, 'µ': micro, 'n': nano,
+             'p': pico, 'f': femto, 'a': atto, 'z': zepto, 'y': zocto}
+_prefixes.update({name: globals()[name] for name in
+                  ('yotta', 'zetta', 'exa', 'peta', 'tera', 'giga', 'mega',
+                   'kilo', 'hecto', 'deka', 'deci', 'centi', 'milli', 'micro',
+                   'nano', 'pico', 'femto', 'atto', 'zepto', 'zocto')})
+_unit_token = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)"
+                         r"|([^\W\d]\w*)|(\*\*|[\^*/()+-]))")
+
+def _unit_row(name):
+    """Return (SI value, packed units) of a unit name, allowing SI prefixes."""
+    if name in _table:
+        row = _table[name]
+        while isinstance(row, str):
+            row = _table[row]
+        return row[0], _pack(row[1])
+    for k in range(len(name) - 1, 0, -1):
+        prefix, unit = name[:k], name[k:]
+        if prefix in _prefixes and unit in _table:
+            value, dims = _unit_row(unit)
+            return _prefixes[prefix]*value, dims
+    raise ValueError(f"unknown unit {name!r}")
+
+@functools.lru_cache(maxsize=1024)
+def _parse_units(s):
+    """Return (SI value, packed units) of the unit string s."""
+    tokens = []
+    pos, s = 0, s.strip()
+    while pos < len(s):
+        m = _unit_token.match(s, pos)
+        if m is None or m.end() == pos:
+            raise ValueError(f"could not parse unit string {s!r} at {s[pos:]!r}")
+        tokens.append(m.groups())
+        pos = m.end()
+    tokens.append((None, None, None))
+    k = 0
+
+    def peek():
+        return tokens[k][2]
+
+    def take(op=None):
+        nonlocal k
+        if op is not None and tokens[k][2] != op:
+            raise ValueError(f"could not parse unit string {s!r}, expected {op!r}")
+        k += 1
+        return tokens[k-1]
+
+    def number():
+        sign = -1 if peek() == '-' else 1
+        if peek() in ('-', '+'):
+            take()
+        num = take()[0]
+        if num is None:
+            raise ValueError(f"could not parse unit string {s!r}, expected a number")
+        return sign*float(num)
+
+    def exponent():
+        if peek() != '(':
+            p = number()
+        else:
+            take('(')
+            p = number()
+            if peek() == '/':
+                take('/')
+                p = p/number()
+            take(')')
+        # Snap to a multiple of 1/_dim_scale, so that rounded powers printed by
+        # _units_str (e.g. m^0.333333) parse back to the exact fraction
+        n = round(p*_dim_scale)
+        if abs(p - n/_dim_scale) < 1e-5:
+            p = n/_dim_scale
+        return p
+
+    def atom():
+        num, name, op = tokens[k]
+        if num is not None:
+            take()
+            return float(num), 0
+        if name is not None:
+            take()
+            return _unit_row(name)
+        take('(')
+        q = product()
+        take(')')
+        return q
+
+    def factor():
+        value, dims = atom()
+        if peek() in ('^', '**'):
+            take()
+            p = exponent()
+            value, dims = value**p, _dims_pow(dims, p)
+        return value, dims
+
+    def product():
+        value, dims = factor()
+        while True:
+            num, name, op = tokens[k]
+            if op == '/':
+                take()
+                v, d = factor()
+                value, dims = value/v, _dims_ok(dims - d)
+            elif op == '*' or num is not None or name is not None or op == '(':
+                if op == '*':
+                    take()
+                v, d = factor()
+                value, dims = value*v, _dims_ok(dims + d)
+            else:
+                return value, dims
+
+    if len(tokens) == 1:
+        return 1.0, 0
+    q = product()
+    if k != len(tokens) - 1:
+        raise ValueError(f"could not parse unit string {s!r}")
+    return q
+
+def parse_units(s):
+    """Return the quantity named by a unit string.
+
+    Parameters
+    ----------
+    s : str
+        Unit string, e.g. "km/s", "g/cm^3", "GPa", "kg m^-3". Names resolve
+        against the predefined units (with optional SI prefixes).
+
+    Returns
+    -------
+    u : preal
+        The unit as a preal (its SI value as a float in stripped mode), so
+        that x*parse_units(s) is x in units s.
+    """
+    value, dims = _parse_units(s)
+    if _stripped:
+        return value
+    return _new_preal(value, dims)
+
+def units_label(s):
+    """Return the SI label of a unit string, as printed by preal (e.g. "kg m^-3")."""
+    return _units_str(_parse_units(s)[1]).lstrip()
+
+def to_si(x, s, out=None):
+    """Convert values x in units s to SI values, in one vectorized multiply."""
+    return np.multiply(x, _parse_units(s)[0], out=out)
+
+def from_si(x, s, out=None):
+    """Convert SI values x to values in units s, in one vectorized divide."""
+    return np.divide(x, _parse_units(s)[0], out=out)
+
+def convert(x, from_units, to_units, out=None):
+    """Convert values x from one unit string to another of the same dimensions."""
+    v1, d1 = _parse_units(from_units)
+    v2, d2 = _parse_units(to_units)
+    if d1 != d2:
+        raise _mismatch()
+    return np.multiply(x, v1/v2, out=out)
+
+### Stripped-units mode
+# Wrappers defined above, kept to restore the units mode
+_wrappers = {f.__name__: f for f in (cos, sin, tan, exp, log, log10)}
+_stripped = False
+
+def _set_stripped(strip):
+    """Swap the module's units and wrappers for floats and numpy, or back."""
+    global _stripped
+    g = globals()
+    for name in _table:
+        g.pop(name, None) # dropped names are resolved again in the new mode
+    for name, f in _wrappers.items():
+        g[name] = getattr(np, name) if strip else f
+    _stripped = bool(strip)
+
+def is_stripped():
+    """Return True if the predefined units are currently plain floats."""
+    return _stripped
+
+@contextlib.contextmanager
+def strip_units(strip=True):
+    """Context manager to run a block with units stripped (or restored).
+
+    Inside `with strip_units():` the module attributes meter, newton, parsec,
+    etc. are plain floats holding their SI values and cos, sin, tan, exp, log,
+    log10 are numpy's functions. `with strip_units(False):` temporarily
+    restores the units in a process started with PHYSUNITS_STRIP=1.
+
+    Note that only lookups through the module (physunits.meter) see the swap;
+    names bound earlier with `from physunits import meter` keep their values.
+    Use the PHYSUNITS_STRIP environment variable to strip those too.
+    """
+    was = _stripped
+    _set_stripped(strip)
+    try:
+        yield
+    finally:
+        _set_stripped(was)
+
+def check_modes(fun, *args, rtol=1e-12, atol=0.0, **kwargs):
+    """Run fun in units mode and in stripped mode and assert the results match.
+
+    Returns the pair (united, stripped) of results, after converting preal and
+    parray results (or tuples/lists of them) to plain SI values. Arguments
+    that are preal or parray are passed as their SI values in the stripped
+    run. Raises
+    AssertionError if they differ by more than rtol/atol (see numpy.allclose)
+    and ValueError from the units mode run if the dimensions do not check out.
+    fun should look up units through the module (e.g. pu.meter) so that it
+    sees the swap.
+    """
+    def si(r):
+        if isinstance(r, (tuple, list)):
+            return type(r)(si(x) for x in r)
+        return _value_of(r)
+    with strip_units(False):
+        united = si(fun(*args, **kwargs))
+    with strip_units(True):
+        args = [si(x) for x in args]
+        kwargs = {k: si(x) for k, x in kwargs.items()}
+        stripped = si(fun(*args, **kwargs))
+    assert np.allclose(united, stripped, rtol=rtol, atol=atol), \
+        f"results differ between units and stripped modes: {united} vs {stripped}"
+    return united, stripped
+
+if os.environ.get('PHYSUNITS_STRIP', '0').lower() not in ('', '0', 'false', 'no'):
+    _set_stripped(True)
+
+def _test():
+    import sys
+    pu = sys.modules[__name__]
+    def pressure_profile(r):
+        rho = 3000*pu.kilogram/pu.meter**3
+        a = 1000*pu.kilometer
+        return 2*np.pi/3*pu.gravity*rho**2*(a**2 - r**2)
+    def escape_speed(M, R):
+        return (2*pu.gravity*M/R)**0.5
+    def decay(t):
+        return pu.exp(-t/(5*pu.hour)), pu.sin(pu.degree*30)
+    with strip_units(False):
+        _check_table()
+        r = np.linspace(0, 1e6, 5)*pu.meter
+        M, R, t = pu.earth_mass, 6371*pu.kilometer, 2*pu.hour
+        assert str(parse_units("g/cm^3")) == "1e+03 kg m^-3"
+        assert type(pu.meter.value) is type(preal(1).value) is np.float64
+        with np.errstate(divide='ignore', invalid='ignore'):
+            assert np.isinf((pu.meter/0).value)
+            assert str((-1*pu.meter)**0.5) == "nan m^0.5"
+        try:
+            pu.meter**3000*pu.meter**3000
+            raise AssertionError("packed units overflowed silently")
+        except ValueError:
+            pass
+    assert units_label("km/s") == units_label(" m s^-1") == "m s^-1"
+    for label in ("m^(1/3)", "kg^(2/3) s^(-7/3)", "m^1.5"):
+        assert units_label(units_label(label)) == units_label(label)
+        assert _parse_units(units_label(label))[1] == _parse_units(label)[1]
+    assert np.all(to_si(np.array([1.0, 2.5]), "GPa") == [1e9, 2.5e9])
+    print(check_modes(pressure_profile, r)[0])
+    print(check_modes(escape_speed, M, R))
+    print(check_modes(decay, t))
+
+__all__ = sorted(set(_table) | {k for k, v in globals().items()
+                                 if not k.startswith('_') and
+                                 not isinstance(v, type(np))})
+
+if __name__ == "__main__":
+    _test()
@@ -5,12 +5,46 @@
 # Author: Naor Movshovitz (nmovshov at gee mail dot com)
 #---------------------------------------------------------------------------------
 import sys, os, shutil
+import abc
 import numpy as np
 import scipy as sp
+import nutils
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-def Q_star_D(target_radius, scaling_method='MKN14_ice'):
+### Scaling laws for Q*D
+# Each law is Q*D = (Q0*(R/m)^a + B*(R/m)^b)*(v/(m/s))^c in J/kg, with the
+# target density folded into B (see the note in Q_star_D), together with the
+# range of target radii [Rmin, Rmax] (m) the law was fit to. Laws published in
+# cgs units (R in cm, v in cm/s, Q*D in erg/g) are converted by _cgs_law.
+def _cgs_law(Q0, a, B, b, c=0.0, rho=1.0, Rmin=0.0, Rmax=np.inf):
+    """Convert cgs power-law coefficients (and density in g/cc) to SI."""
+    return (Q0*1e-4*100.0**(a + c), a, B*rho*1e-4*100.0**(b + c), b, c, Rmin, Rmax)
+
+_QSD_LAWS = {
+    # Our 2014 Spheral++ simulations together with Benz & Asphaug 1999 data
+    'MKN14_ice':    (0.0, 0.0, 0.05, 1.1876, 0.0, 1e5, 1e6),
+    'MKN14_basalt': (0.0, 0.0, 1.48, 0.9893, 0.0, 1e5, 1e6),
+    # Benz & Asphaug (1999), table III; strength and gravity regimes
+    'BA99_basalt':      _cgs_law(9.0e7, -0.36, 0.5, 1.36,
+                                  rho=2.7, Rmin=1e-2, Rmax=1e5),
+    'BA99_basalt_3kms': _cgs_law(3.5e7, -0.38, 0.3, 1.36,
+                                  rho=2.7, Rmin=1e-2, Rmax=1e5),
+    'BA99_ice':         _cgs_law(1.6e7, -0.39, 1.2, 1.26,
+                                  rho=0.9, Rmin=1e-2, Rmax=1e5),
+    'BA99_ice_05kms':   _cgs_law(7.0e7, -0.45, 2.1, 1.19,
+                                  rho=0.9, Rmin=1e-2, Rmax=1e5),
+    # Leinhardt & Stewart (2012), small-body laws, which depend on impact speed
+    'LS12_strong': _cgs_law(7e4, 9*0.5/(3 - 2*8), 1e-4, 3*0.5, 2 - 3*0.5),
+    'LS12_weak':   _cgs_law(5e2, 9*0.4/(3 - 2*7), 1e-4, 3*0.4, 2 - 3*0.4),
+    # Leinhardt & Stewart (2012), gravity regime, c*(4/5)*pi*rho1*G*R_C1^2 with
+    # c* = 1.9, rho1 = 1000 kg/m^3 and R_C1 ~ R (small projectiles)
+    'LS12_gravity': (0.0, 0.0, 1.9*0.8*np.pi*1000*6.674e-11, 2.0, 0.0, 0.0, np.inf),
+    }
+_QSD_NAMES = list(_QSD_LAWS)
+_QSD_TABLE = np.array([_QSD_LAWS[k] for k in _QSD_NAMES]).T
+
+def Q_star_D(target_radius, scaling_method='MKN14_ice', v=None, check=True):
     """Return power-law scaled, threshold specific energy for disruption, Q*D.
     
     The fraction of mass ejected from a target after a gravity regime collision
@@ -19,39 +53,78 @@ def Q_star_D(target_radius, scaling_method='MKN14_ice'):
     gravity regime, we find that Q*D(R) can be approximated by a power law:
             Q*D(R) = B*(R/meters)^b.
     This function returns Q*D for an ice or basalt target, based on a few sources.
+    Laws that include the strength regime add a term Q0*(R/meters)^a, and the
+    small-body laws of Leinhardt & Stewart (2012) scale with impact speed as
+    (v/(m/s))^c. The coefficients are in the table _QSD_LAWS.
     
     Note: Unlike Benz & Asphaug (1999) we do not bother separating the
     multiplicative constant from the target density, since the density is implied
     in the target type anyway.
+
+    All arguments broadcast, so one call evaluates a whole population of targets,
+    and scaling_method may be an array of law names (one per target).
     
     Parameters
     ----------
-    target_radius : numeric, scalar, positive
+    target_radius : numeric, scalar or array, positive
         Target's radius in meters.
-    scaling_method : string in ['MKN14_ice', 'MKN14_basalt'], (optional)
-        Power-law choice. Default is 'MKN14_ice', for power law derived from our
-        2014 Spheral++ simulations together with Benz & Asphaug 1999 data.
+    scaling_method : string, or array of strings or of integer indices into
+                     list(_QSD_LAWS), (optional)
+        Power-law choice, a key of _QSD_LAWS: 'MKN14_ice', 'MKN14_basalt',
+        'BA99_basalt', 'BA99_basalt_3kms', 'BA99_ice', 'BA99_ice_05kms',
+        'LS12_strong', 'LS12_weak', or 'LS12_gravity'. Default is 'MKN14_ice',
+        for power law derived from our 2014 Spheral++ simulations together with
+        Benz & Asphaug 1999 data.
+    v : numeric, scalar or array, (optional)
+        Impact speed in m/s, needed only by the LS12_strong and LS12_weak laws.
+    check : bool, (optional)
+        If True (default) assert that all radii are finite, positive, and
+        inside the radius range the chosen law was fit to. Pass False to skip
+        these whole-array checks in production runs.
     """
     
-    # Some minimal assertions
-    assert np.isscalar(target_radius) and np.isfinite(target_radius) 
-    assert np.isreal(target_radius) and target_radius > 0
-    assert scaling_method in ['MKN14_ice', 'MKN14_basalt']
-    assert 1e5 <= target_radius <= 1e6, "Expecting target radius in meters."
-
-    # Choose power-law parameters based on scaling_method
-    if scaling_method is 'MKN14_ice':
-        B = 0.05 # J/kg
-        b = 1.1876
-    elif scaling_method is 'MKN14_basalt':
-        B = 1.48 # J/kg
-        b = 0.9893
+    # Look up power-law parameters based on scaling_method
+    R = np.asarray(target_radius, dtype=float)
+    if isinstance(scaling_method, str):
+        try:
+            Q0, a, B, b, c, Rmin, Rmax = _QSD_LAWS[scaling_method]
+        except KeyError:
+            raise ValueError(f"Unknown scaling method {scaling_method!r}. "
+                             f"Use one of: {_QSD_NAMES}") from None
+    else:
+        methods = np.asarray(scaling_method)
+        if np.issubdtype(methods.dtype, np.integer):
+            rows = methods
+        else:
+            rows = np.full(methods.shape, -1)
+            for k, name in enumerate(_QSD_NAMES):
+                rows[methods == name] = k
+                pass
+            if np.any(rows < 0):
+                unknown = sorted(set(methods[rows < 0].tolist()))
+                raise ValueError(f"Unknown scaling methods {unknown}. "
+                                 f"Use one of: {_QSD_NAMES}")
+        Q0, a, B, b, c, Rmin, Rmax = _QSD_TABLE[:,rows]
+
+    # Some minimal assertions, on the whole array at once
+    if check:
+        assert np.all(np.isfinite(R)) and np.all(R > 0)
+        assert np.all((Rmin <= R) & (R <= Rmax)), \
+            "Expecting target radius in meters."
+        assert v is not None or np.all(c == 0), \
+            "This scaling law needs the impact speed v."
+
     # Return a power-law scaled Q*D
-    QsD = B*target_radius**b
+    QsD = B*R**b
+    if np.any(Q0 != 0):
+        QsD = QsD + Q0*R**a
+    if np.any(c != 0):
+        QsD = QsD*np.asarray(v, dtype=float)**c
 
-    return QsD
+    return QsD[()]
 
-def hydrostatic_2layer_incompressible_pressure_profile(R, rc, rhoc, rhom, G=6.674e-11):
+def hydrostatic_2layer_incompressible_pressure_profile(R, rc, rhoc, rhom, G=6.674e-11,
+                                                       out=None):
     """Return pressure inside a small, hydrostatic, 2-layer planet.
     
     Assuming constant density in the two-layers, the hydrostatic equation:
@@ -64,33 +137,40 @@ def hydrostatic_2layer_incompressible_pressure_profile(R, rc, rhoc, rhom, G=6.67
     radial distance, and returns the pressure at each point in R, assuming that 
     the planet's outer radius is max(R). The second mode takes a scalar R,
     interpreted as the planet's radius, and returns the central pressure.
+
+    The layer parameters rc, rhoc, rhom may also be arrays (broadcast against
+    each other) describing a batch of models sharing the grid R. The profile is
+    then returned with shape broadcast(rc, rhoc, rhom).shape + R.shape, e.g. a
+    (n_models, n_r) table for vectors of parameters, and the central pressure
+    with shape broadcast(rc, rhoc, rhom).shape.
     
     Parameters
     ----------
     R : numeric, scalar or vector
         If scalar, planet's outer radius. If vector, list of positions where
         pressure is to be calculated, and max(R) is planet's radius.
-    rc : numeric, scalar, positive
+    rc : numeric, scalar or array, positive
         Radius of core/mantle boundary.
-    rhoc : numeric, scalar, positive
+    rhoc : numeric, scalar or array, positive
         Density of inner layer (core).
-    rhom : numeric, scalar, positive
+    rhom : numeric, scalar or array, positive
         Density of outer layer (mantle).
     G : numeric, scalar, positive, (optional)
         Value for universal gravitational constant. The default value is in SI 
         units, so if R and rc are given in meters and rhoc and rhoc are given in
         kg/m^3 then the returned pressure is in Pa.
+    out : ndarray, (optional)
+        Array of the profile's shape to write the profile into (vector R only).
     """
     
-    R = np.array(R)
+    R = np.asarray(R, dtype=float)
     assert np.all(np.isreal(R))
     assert np.all(R>=0)
-    assert isinstance(rc,(int,float))
-    assert isinstance(rhoc,(int,float))
-    assert isinstance(rhom,(int,float))
+    rc, rhoc, rhom = np.broadcast_arrays(*(np.asarray(v, dtype=float)
+                                           for v in (rc, rhoc, rhom)))
     assert isinstance(G,(int,float))
-    assert rc > 0 and rhoc > 0 and rhom > 0 and G > 0
-    assert rc < R.max()
+    assert np.all(rc > 0) and np.all(rhoc > 0) and np.all(rhom > 0) and G > 0
+    assert np.all(rc < R.max())
     
     a = R.max()
     c2 = 4*np.pi/3*G*(0.5*rhom**2*a**2 - rhom*(rhoc - rhom)*rc**3/a)
@@ -98,22 +178,26 @@ def hydrostatic_2layer_incompressible_pressure_profile(R, rc, rhoc, rhom, G=6.67
     
     # Two branches, depending on what user had in mind
     if R.size == 1: # user wants central pressure
-        return c1
-    else: # user wants a profile
-        p = np.ones(R.size)*np.NaN
-        for k in range(R.size):
-            if R[k] <= rc:
-                p[k] = c1 - 4*np.pi/3*G*0.5*rhoc**2*R[k]**2
-            else:
-                p[k] = c2 - 4*np.pi/3*G*(0.5*rhom**2*R[k]**2 -
-                                         rhom*(rhoc - rhom)*rc**3/R[k])
-                pass
-            pass
+        return c1[()]
+    else: # user wants a profile, both layers evaluated on the whole grid
+        shape = rc.shape + R.shape
+        (c1, c2, rc, rhoc, rhom) = (v.reshape(v.shape + (1,)*R.ndim)
+                                    for v in (c1, c2, rc, rhoc, rhom))
+        if out is None:
+            out = np.empty(shape)
+        assert out.shape == shape
+        p = np.multiply(R**2, 4*np.pi/3*G*0.5*rhoc**2, out=out)
+        np.subtract(c1, p, out=p)
+        mantle = R > rc
+        if np.any(mantle):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pm = c2 - 4*np.pi/3*G*(0.5*rhom**2*R**2 - rhom*(rhoc - rhom)*rc**3/R)
+            np.copyto(p, pm, where=mantle)
         pass
     
     return p
     
-def hydrostatic_1layer_incompressible_pressure_profile(R, rho, G=6.674e-11):
+def hydrostatic_1layer_incompressible_pressure_profile(R, rho, G=6.674e-11, out=None):
     """Return pressure inside a small, hydrostatic, 1-layer planet.
     
     Assuming constant density, the hydrostatic equation:
@@ -126,42 +210,616 @@ def hydrostatic_1layer_incompressible_pressure_profile(R, rho, G=6.674e-11):
     radial distance, and returns the pressure at each point in R, assuming that 
     the planet's outer radius is max(R). The second mode takes a scalar R, 
     interpreted as the planet's radius, and returns the central pressure.
+
+    The density rho may also be an array describing a batch of models sharing
+    the grid R, in which case the profile has shape rho.shape + R.shape.
     
     Parameters
     ----------
     R : numeric, scalar or vector
         If scalar, planet's outer radius. If vector, list of positions where
         pressure is to be calculated, and max(R) is planet's radius.
-    rho : numeric, scalar, positive
+    rho : numeric, scalar or array, positive
         Density (assumed constant) of planet.
     G : numeric, scalar, positive, (optional)
         Value for universal gravitational constant. The default value is in SI 
         units, so if R is given in meters and rho is given in kg/m^3 then the
         returned pressure is in Pa.
+    out : ndarray, (optional)
+        Array of the profile's shape to write the profile into (vector R only).
     """
     
-    R = np.array(R)
+    R = np.asarray(R, dtype=float)
     assert np.all(np.isreal(R))
     assert np.all(R>=0)
-    assert isinstance(rho,(int,float))
+    rho = np.asarray(rho, dtype=float)
     assert isinstance(G,(int,float))
-    assert rho > 0 and G > 0
+    assert np.all(rho > 0) and G > 0
     
     a = R.max()
     
     # Two branches, depending on what user had in mind
     if R.size == 1: # user wants central pressure
-        return 2*np.pi/3*G*rho**2*a**2
+        return (2*np.pi/3*G*rho**2*a**2)[()]
     else: # user wants a profile
-        p = np.ones(R.size)*np.NaN
-        for k in range(R.size):
-            p[k] = 2*np.pi/3*G*rho**2*(a**2 - R[k]**2)
+        shape = rho.shape + R.shape
+        rho = rho.reshape(rho.shape + (1,)*R.ndim)
+        if out is None:
+            out = np.empty(shape)
+        assert out.shape == shape
+        p = np.subtract(a**2, R**2, out=out)
+        p *= 2*np.pi/3*G*rho**2
         pass
     
     return p
 
+def hydrostatic_nlayer_incompressible_pressure_profile(R, rb, rho, G=6.674e-11):
+    """Return pressure inside a small, hydrostatic, N-layer planet.
+
+    The N-layer generalization of the 2-layer function. With constant density
+    rho[i] in layer i, the enclosed mass in the layer is M(r) = A + B*r^3, so
+    the hydrostatic equation integrates in closed form; the pressure drop
+    across each layer is computed once and the pressure at the layer tops is
+    their cumulative sum from the surface down.
+
+    Like its siblings the function takes a vector R, and returns the pressure at
+    each point in R, with max(R) the planet's radius, or a scalar R, the
+    planet's radius, and returns the central pressure. Leading dimensions of rb
+    and rho (which broadcast against each other) describe a batch of models
+    sharing R; the profile then has shape batch_shape + R.shape.
+
+    Parameters
+    ----------
+    R : numeric, scalar or vector
+        If scalar, planet's outer radius. If vector, list of positions where
+        pressure is to be calculated, and max(R) is planet's radius.
+    rb : array, shape (..., N-1), positive, increasing
+        Radii of the boundaries between layers, innermost first.
+    rho : array, shape (..., N), positive
+        Density of each layer, innermost first.
+    G : numeric, scalar, positive, (optional)
+        Value for universal gravitational constant (default in SI units).
+    """
+
+    R = np.asarray(R, dtype=float)
+    assert np.all(R>=0)
+    rb = np.asarray(rb, dtype=float)
+    rho = np.asarray(rho, dtype=float)
+    assert rb.shape[-1:] == (rho.shape[-1] - 1,), "need one more density than radius"
+    assert np.all(rho > 0) and G > 0
+    a = R.max()
+    assert np.all(np.diff(rb, axis=-1) > 0) and np.all(rb > 0) and np.all(rb < a)
+
+    # Layer inner and outer radii and the mass law M(r) = A + B*r^3 per layer
+    batch = np.broadcast_shapes(rb.shape[:-1], rho.shape[:-1])
+    rho = np.broadcast_to(rho, batch + rho.shape[-1:])
+    edges = np.concatenate([np.zeros(batch + (1,)), np.broadcast_to(rb, batch +
+                            rb.shape[-1:]), np.full(batch + (1,), a)], axis=-1)
+    rlo, rhi = edges[...,:-1], edges[...,1:]
+    B = 4*np.pi/3*rho
+    M = np.cumsum(B*(rhi**3 - rlo**3), axis=-1)
+    A = M - B*rhi**3
+    inv_rlo = np.divide(1.0, rlo, out=np.zeros_like(rlo), where=rlo>0)
+    dP = G*rho*(A*(inv_rlo - 1/rhi) + B/2*(rhi**2 - rlo**2))
+    Ptop = np.cumsum(dP[...,::-1], axis=-1)[...,::-1] - dP
+
+    # Two branches, depending on what user had in mind
+    if R.size == 1: # user wants central pressure
+        return dP.sum(axis=-1)[()]
+    else: # user wants a profile, filled one layer at a time
+        p = np.empty(batch + R.shape)
+        ex = (Ellipsis,) + (np.newaxis,)*R.ndim
+        invR = np.divide(1.0, R, out=np.zeros_like(R), where=R>0)
+        for i in range(rho.shape[-1]):
+            lo, hi = rlo[...,i][ex], rhi[...,i][ex]
+            pi = Ptop[...,i][ex] + G*rho[...,i][ex]*(A[...,i][ex]*(invR - 1/hi) +
+                                                       B[...,i][ex]/2*(hi**2 - R**2))
+            np.copyto(p, pi, where=(R <= hi) & ((R > lo) if i > 0 else True))
+            pass
+        pass
+
+    return p
+
+def hydrostatic_tabulated_pressure_profile(r, rho, G=6.674e-11, ngauss=8):
+    """Return pressure inside a hydrostatic planet with tabulated density.
+
+    The density is taken to be linear in r between the tabulated points (and
+    constant, rho[0], below r[0] if r[0] > 0), so the enclosed mass M(r) is an
+    exact polynomial in each interval. The pressure drop across each interval,
+    the integral of G*M(r)*rho(r)/r^2, is done by ngauss-point Gauss-Legendre
+    quadrature (nutils.gauleg), and the pressure at the table points is the
+    cumulative sum of the drops from the surface (p = 0 at r[-1]) down. A
+    density jump is represented by repeating its radius in r.
+
+    Leading dimensions of r and rho (which broadcast against each other)
+    describe a batch of models, e.g. rho of shape (n_models, n_r) with a shared
+    r of shape (n_r,), all solved at once.
+
+    Parameters
+    ----------
+    r : array, shape (..., n_r), non-negative, non-decreasing
+        Radii of the density table, with r[-1] the planet's radius.
+    rho : array, shape (..., n_r), positive
+        Density at r.
+    G : numeric, scalar, positive, (optional)
+        Value for universal gravitational constant (default in SI units).
+    ngauss : int, (optional)
+        Number of quadrature points per interval.
+
+    Returns
+    -------
+    p : array, shape (..., n_r)
+        Pressure at r.
+    pc : array, shape (...)
+        Central pressure.
+    """
+
+    r = np.asarray(r, dtype=float)
+    rho = np.asarray(rho, dtype=float)
+    assert np.all(r >= 0) and np.all(np.diff(r, axis=-1) >= 0)
+    assert np.all(rho > 0) and G > 0
+    shape = np.broadcast_shapes(r.shape, rho.shape)
+    r = np.broadcast_to(r, shape)
+    rho = np.broadcast_to(rho, shape)
+
+    # Intervals from the center out; the first one, [0, r[0]], at constant rho[0]
+    rr = np.concatenate([np.zeros(shape[:-1] + (1,)), r], axis=-1)
+    rrho = np.concatenate([rho[...,:1], rho], axis=-1)
+    rlo, rhi = rr[...,:-1], rr[...,1:]
+    dr = rhi - rlo
+    k = np.divide(np.diff(rrho, axis=-1), dr, out=np.zeros_like(dr), where=dr>0)
+    alpha = rrho[...,:-1] - k*rlo
+    def mass(s, alpha, k): # 4*pi*integral of s^2*(alpha + k*s), up to a constant
+        return (4*np.pi*s*s*s)*(alpha/3 + (k/4)*s)
+    dM = mass(rhi, alpha, k) - mass(rlo, alpha, k)
+    Mlo = np.cumsum(dM, axis=-1) - dM
+
+    # Pressure drop across each interval by Gauss-Legendre quadrature
+    t, w = nutils.gauleg(-1, 1, ngauss)
+    x = 0.5*(rlo + rhi)[...,None] + 0.5*dr[...,None]*t
+    alpha, k, rlo = alpha[...,None], k[...,None], rlo[...,None]
+    Mx = Mlo[...,None] + mass(x, alpha, k) - mass(rlo, alpha, k)
+    f = np.divide(G*Mx*(alpha + k*x), x**2, out=np.zeros_like(x), where=x>0)
+    dP = 0.5*dr*(f @ w)
+
+    # Pressure at the inner edge of each interval, summed from the surface down
+    P = np.cumsum(dP[...,::-1], axis=-1)[...,::-1]
+    p = np.concatenate([P[...,1:], np.zeros(shape[:-1] + (1,))], axis=-1)
+    return p, P[...,0]
+
+### Equations of state and compressible interiors
+class EquationOfState(abc.ABC):
+    """An equation-of-state abstract base class.
+
+    Subclasses implement density(P), returning the density at pressure P. P is
+    an ndarray (e.g. a whole radial grid, or a (n_models, n_r) table) and any
+    array-valued parameters of the EOS broadcast against it, so a batch of
+    models can be described by one EOS object with parameters of shape
+    (n_models, 1). All quantities are in SI units. Subclasses should be
+    defined at module level so they can be sent to worker processes. A
+    subclass that does not define density cannot be instantiated.
+    """
+
+    @abc.abstractmethod
+    def density(self, P):
+        """Return the density at pressure P."""
+
+class ConstantDensityEOS(EquationOfState):
+    """The incompressible equation of state, rho(P) = rho0."""
+
+    def __init__(self, rho0):
+        self.rho0 = np.asarray(rho0, dtype=float)
+
+    def density(self, P):
+        return self.rho0 + np.zeros_like(P)
+
+class IdealGasEOS(EquationOfState):
+    """The isothermal ideal gas, rho = P*mu/(R_gas*T), with mu in kg/mol.
+
+    The density vanishes with P, so a planet with an ideal-gas layer on top
+    needs a positive surface pressure (p_surf in
+    hydrostatic_compressible_pressure_profile).
+    """
+
+    R_gas = 8.314462618 # J/(mol K)
+
+    def __init__(self, T, mu=2.3e-3):
+        self.T = np.asarray(T, dtype=float)
+        self.mu = np.asarray(mu, dtype=float)
+
+    def density(self, P):
+        return P*self.mu/(self.R_gas*self.T)
+
+    def pressure(self, rho):
+        return rho*self.R_gas*self.T/self.mu
+
+class PolytropeEOS(EquationOfState):
+    """The modified polytrope rho(P) = rho0 + c*P^n of Seager et al. (2007).
+
+    Seager, S., et al., 2007. Mass-radius relationships for solid exoplanets.
+    ApJ, 669(2), p.1279. The materials in their table 3 are available as
+    PolytropeEOS.iron(), .perovskite() (MgSiO3) and .water().
+    """
+
+    def __init__(self, rho0, c, n):
+        self.rho0 = np.asarray(rho0, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+        self.n = np.asarray(n, dtype=float)
+
+    def density(self, P):
+        return self.rho0 + self.c*np.maximum(P, 0.0)**self.n
+
+    def pressure(self, rho):
+        return ((rho - self.rho0)/self.c)**(1/self.n)
+
+    @classmethod
+    def iron(cls):
+        return cls(8300.0, 0.00349, 0.528)
+
+    @classmethod
+    def perovskite(cls):
+        return cls(4100.0, 0.00161, 0.541)
+
+    @classmethod
+    def water(cls):
+        return cls(1460.0, 0.00311, 0.513)
+
+def hydrostatic_compressible_pressure_profile(r, eos, rb=None, rho0=None, G=6.674e-11,
+                                              rtol=1e-10, maxiter=200, relax=1.0,
+                                              ngauss=8, p_surf=0.0):
+    """Return density and pressure in a self-consistent, compressible planet.
+
+    Starting from a density guess on the whole grid r, alternately solve the
+    hydrostatic equation for P(r) given rho(r) (with
+    hydrostatic_tabulated_pressure_profile, plus p = p_surf at r[-1]) and update
+    rho(r) = eos.density(P(r)), until the relative density change is below rtol
+    everywhere. A previous solution (e.g. of a nearby model in a grid search)
+    passed as rho0 warm-starts the iteration, usually converging in a few
+    steps; the default starts from the density at the surface pressure.
+
+    With a sequence of EOS objects the planet is layered: layer i, innermost
+    first, ends at rb[i] and the last layer at r[-1]. Each boundary radius must
+    appear twice in r (the density jumps there); points before the repeat
+    belong to the inner layer.
+
+    EOS parameters may be arrays of shape (n_models, 1) (or any batch shape
+    followed by 1) to solve a batch of models sharing r at once; rho and p then
+    have shape (n_models, n_r). To spread many models over processes use
+    hydrostatic_compressible_models.
+
+    Parameters
+    ----------
+    r : vector, non-negative, non-decreasing
+        Radial grid, with r[-1] the planet's radius.
+    eos : EquationOfState, or sequence of them
+        Equation of state, or one per layer (innermost first).
+    rb : vector, (optional)
+        Radii of the layer boundaries, required with a sequence of eos.
+    rho0 : array, (optional)
+        Initial density on r (default eos.density(p_surf)).
+    G : numeric, scalar, positive, (optional)
+        Value for universal gravitational constant (default in SI units).
+    rtol : float, (optional)
+        Convergence tolerance on max|rho_new/rho - 1|.
+    maxiter : int, (optional)
+        Maximum number of iterations; RuntimeError if not converged.
+    relax : float in (0, 1], (optional)
+        Under-relaxation factor for the density update (1 is plain iteration).
+    ngauss : int, (optional)
+        Quadrature points per interval for the pressure integral.
+    p_surf : numeric or array, non-negative, (optional)
+        Pressure at r[-1] (default 0). Must be positive if the outer layer's
+        density vanishes at zero pressure, e.g. with IdealGasEOS. An array
+        broadcasts against the batch shape of the models.
+
+    Returns
+    -------
+    rho : array, shape (..., n_r)
+        Density on r.
+    p : array, shape (..., n_r)
+        Pressure on r.
+    pc : array, shape (...)
+        Central pressure.
+    niter : int
+        Number of iterations done.
+    """
+
+    r = np.asarray(r, dtype=float)
+    assert r.ndim == 1 and np.all(np.diff(r) >= 0)
+    assert 0 < relax <= 1
+    if isinstance(eos, EquationOfState):
+        eoss, layers = [eos], [slice(None)]
+    else:
+        eoss = list(eos)
+        rb = np.asarray(rb, dtype=float)
+        assert rb.shape == (len(eoss) - 1,), "need one boundary between each layer"
+        layer = np.searchsorted(rb, r, side='left')
+        layer[1:] += (np.diff(r) == 0) & np.isin(r[1:], rb)
+        layers = [np.flatnonzero(layer == i) for i in range(len(eoss))]
+        assert all(len(idx) > 0 for idx in layers), "every layer needs grid points"
+
+    def density(P):
+        rho = np.empty(P.shape)
+        for e, idx in zip(eoss, layers):
+            rho[...,idx] = e.density(P[...,idx])
+            pass
+        return rho
+
+    p_surf = np.asarray(p_surf, dtype=float)
+    assert np.all(p_surf >= 0)
+    ps = p_surf[...,None] # broadcasts against (..., n_r)
+    def solve(rho):
+        if not np.all(rho > 0):
+            raise ValueError("non-positive density on the grid; an EOS with "
+                             "rho(0) = 0 needs a positive p_surf")
+        p, pc = hydrostatic_tabulated_pressure_profile(r, rho, G, ngauss)
+        return p + ps, pc + p_surf
+
+    if rho0 is None:
+        batch = np.broadcast_shapes(p_surf.shape,
+                                    *(np.shape(e.density(np.zeros(1)))[:-1]
+                                      for e in eoss))
+        rho = density(np.broadcast_to(ps, batch + r.shape))
+    else:
+        rho = np.array(rho0, dtype=float)
+    for niter in range(1, maxiter + 1):
+        p, pc = solve(rho)
+        rho_new = density(p)
+        if rho_new.shape != rho.shape: # a batched EOS with a single rho0
+            rho = np.broadcast_to(rho, rho_new.shape)
+        change = np.max(np.abs(rho_new/rho - 1))
+        rho = rho_new if relax == 1 else (1 - relax)*rho + relax*rho_new
+        if change < rtol:
+            break
+        pass
+    else:
+        raise RuntimeError(f"density did not converge in {maxiter} iterations "
+                           f"(relative change {change:.2g})")
+    p, pc = solve(rho)
+
+    return rho, p, pc, niter
+
+def hydrostatic_compressible_models(r, models, rb=None, rho0=None, processes=None,
+                                    **kwargs):
+    """Solve many compressible planets, spread over a pool of processes.
+
+    Each entry of models is the eos argument of
+    hydrostatic_compressible_pressure_profile (an EOS, possibly with batched
+    parameters, or a sequence of layer EOSs); all share r, rb and kwargs.
+    rho0, if given, is a matching sequence of warm-start densities (entries
+    may be None). Returns the list of (rho, p, pc, niter) results in order.
+    With processes=1 the models are solved in this process.
+    """
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if rho0 is None:
+        rho0 = [None]*len(models)
+    jobs = [(r, eos, rb, x0, kwargs) for eos, x0 in zip(models, rho0)]
+    if processes == 1:
+        return list(map(_compressible_job, jobs))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(int(processes)) as pool:
+        return list(pool.map(_compressible_job, jobs))
+
+def _compressible_job(job):
+    r, eos, rb, rho0, kwargs = job
+    return hydrostatic_compressible_pressure_profile(r, eos, rb, rho0, **kwargs)
+
+### Impact geometry
+def sphereslice(rrat, theta, phi=0.0, ngauss=24, chunksize=2**16):
+    """Intersecting volume fractions of passing spheres.
+
+    alphas = sphereslice(rrat, theta, phi) returns the fraction of volumes of two
+    spheres that intersects as they move across each other in a straight line.
+    The geometry is the same as in sphereslice.m: the relative motion is
+    parallel to the x-axis, the larger sphere (of radius R = 1) is centered at
+    the origin and the smaller one (of radius r = rrat) first touches it from
+    (R + r)*[1, sin(theta), sin(phi)]. The volume fraction of the larger sphere
+    is returned in alphas[...,0] and that of the smaller in alphas[...,1].
+
+    The volume swept through each sphere by the other one is its intersection
+    with an infinite cylinder, of radius r (or R), whose axis is the
+    trajectory, at distance d = (R + r)*sqrt(sin(theta)^2 + sin(phi)^2) from
+    the sphere's center. The slice of that volume at each x is the lens shared
+    by two circles, whose area is known in closed form. It is integrated along
+    x exactly where one circle holds the other or they are apart, and with
+    ngauss-point Gauss-Legendre quadrature (nutils.gauleg) on the stretch
+    where they cross. Unlike the 3D grid of sphereslice.m this takes O(ngauss)
+    work and memory per geometry and converges much faster (to ~1e-7 at the
+    default ngauss). Inputs are processed chunksize geometries at a time, so
+    memory use does not grow with their number.
+
+    Parameters
+    ----------
+    rrat : array_like, positive
+        Ratio of the smaller sphere's radius to the larger's (<= 1).
+    theta, phi : array_like
+        Impact angles in radians (phi defaults to 0). All three broadcast
+        together.
+    ngauss : int, (optional)
+        Quadrature points per smooth stretch.
+    chunksize : int, (optional)
+        Geometries per vectorized block.
+
+    Returns
+    -------
+    alphas : array, shape (..., 2)
+        Intersecting volume fractions of the larger and smaller spheres.
+    """
+
+    rrat, theta, phi = np.broadcast_arrays(*(np.asarray(a, dtype=float)
+                                             for a in (rrat, theta, phi)))
+    assert np.all(rrat > 0) and np.all(rrat <= 1)
+    shape = rrat.shape
+    r = rrat.ravel()
+    d = (1 + r)*np.hypot(np.sin(theta.ravel()), np.sin(phi.ravel()))
+
+    # The target's slice by a cylinder of radius r, the projectile's by radius 1
+    t, w = nutils.gauleg(-1, 1, ngauss)
+    alphas = np.empty((r.size, 2))
+    for lo in range(0, r.size, chunksize):
+        s = slice(lo, lo + chunksize)
+        ones = np.ones_like(r[s])
+        alphas[s,0] = _cylinder_slice(ones, r[s], d[s], t, w)
+        alphas[s,1] = _cylinder_slice(r[s], ones, d[s], t, w)
+        pass
+    return alphas.reshape(shape + (2,))
+
+def _cylinder_slice(a, b, d, t, w):
+    """Volume fraction of spheres of radius a inside cylinders of radius b.
+
+    The cylinder axes pass at distance d from the spheres' centers. The slice
+    at x is a circle of radius c = sqrt(a^2 - x^2). Where c >= d + b it holds
+    the cylinder's cross-section, and where c <= |d - b| it is either inside it
+    (if d < b) or clear of it, so only the stretch between needs the rule
+    (t, w) on [-1, 1].
+    """
+
+    x1 = np.sqrt(np.clip(a*a - (d + b)**2, 0, None))
+    x2 = np.sqrt(np.clip(a*a - (d - b)**2, 0, None))
+    x = 0.5*(x1 + x2)[:,None] + 0.5*(x2 - x1)[:,None]*t
+    c = np.sqrt(np.clip(a[:,None]**2 - x*x, 0, None))
+    V = np.pi*b*b*x1 + 0.5*(x2 - x1)*(_lens_area(c, b[:,None], d[:,None]) @ w)
+    V += np.where(d < b, np.pi*(a*a*(a - x2) - (a**3 - x2**3)/3), 0.0)
+    return 2*V/(4/3*np.pi*a**3)
+
+def _lens_area(a, b, d):
+    """Area shared by circles of radii a and b with centers d apart."""
+    d = np.maximum(d, np.finfo(float).tiny)
+    with np.errstate(over='ignore'):
+        ca = np.clip((d*d + a*a - b*b)/(2*d*a), -1, 1)
+        cb = np.clip((d*d + b*b - a*a)/(2*d*b), -1, 1)
+    # Disjoint or nested circles clip ca and cb to +/-1, giving 0 or pi*min^2
+    return a*a*np.arccos(ca) + b*b*np.arccos(cb) - d*a*np.sqrt(1 - ca*ca)
+
+def xdr2np(filename, be=False, columns=None, by_var=False):
+    """Return a memory-mapped view of the data in an xplot-style xdr file.
+
+    A .xdr file is the format used by CSPH for input and output. It consists of
+    an ASCII header, ending in a ^^^ delimiter line, and followed by a stream
+    of unformatted, single precision numbers. The second header line holds the
+    number of particles and the number of variables (separated by a comma,
+    dash, or space), which give the shape of the data. Nothing is read beyond
+    the header: the data are returned as a read-only np.memmap, so columns of a
+    snapshot larger than memory can be sliced, or passed to eclazz or the
+    potential kernels, and only the pages touched are loaded.
+
+    Parameters
+    ----------
+    filename : str
+        Name of .xdr file.
+    be : bool, (optional)
+        Read the data as big-endian. The default is False as little-endian is
+        near-universal these days.
+    columns : int or sequence of ints, (optional)
+        Return only these variables (as views, in the given order) instead of
+        the whole (nbParticles, nbVars) array.
+    by_var : bool, (optional)
+        Set if the stream holds all particles' values of one variable after
+        the other, rather than (the default) all variables of one particle.
+        The returned arrays have the same (nbParticles, nbVars) indexing either
+        way, only the strides differ.
+
+    Returns
+    -------
+    data : np.memmap or tuple of them
+        float32 array of shape (nbParticles, nbVars), or the selected columns.
+    header : str
+        The ASCII header text.
+    """
+
+    # Scan the header, looking for indicated number of vars and counting bytes
+    lines = []
+    with open(filename, 'rb') as f:
+        for line in f:
+            lines.append(line.decode('ascii', errors='replace'))
+            if line.rstrip(b'\r\n') == b'^^^':
+                break
+        else:
+            raise ValueError("Wrong format in XDR file: no ^^^ header delimiter")
+    offset = sum(len(line.encode('ascii', errors='replace')) for line in lines)
+    header = ''.join(lines)
+    try:
+        tokens = lines[1].replace(',', ' ').replace('-', ' ').split()
+        nbParticles, nbVars = int(tokens[0]), int(tokens[1])
+    except (IndexError, ValueError):
+        raise ValueError("Wrong format in XDR file") from None
+    if os.path.getsize(filename) - offset < 4*nbParticles*nbVars:
+        raise ValueError(f"XDR file {filename} is shorter than its header says "
+                         f"({nbParticles} particles x {nbVars} variables)")
+
+    # Map (not read) the data, with the right byte order and shape
+    dtype = np.dtype('>f4' if be else '<f4')
+    if by_var:
+        data = np.memmap(filename, dtype, 'r', offset, (nbVars, nbParticles)).T
+    else:
+        data = np.memmap(filename, dtype, 'r', offset, (nbParticles, nbVars))
+    if columns is not None:
+        if np.isscalar(columns):
+            return data[:,columns], header
+        return tuple(data[:,k] for k in columns), header
+    return data, header
+
 def _test():
-    print "alo"
+    # Minimal assertions
+    assert Q_star_D(2e5) == 0.05*2e5**1.1876
+    Q = Q_star_D([2e5, 5e5], ['MKN14_ice', 'MKN14_basalt'])
+    assert np.all(Q == [Q_star_D(2e5), Q_star_D(5e5, 'MKN14_basalt')])
+    assert Q_star_D(1e3, 'LS12_weak', v=3e3) > 0
+    R = np.linspace(0, 1e6, 1001)
+    p = hydrostatic_2layer_incompressible_pressure_profile(R, 5e5, 8000, 3000)
+    assert p[0] == hydrostatic_2layer_incompressible_pressure_profile(1e6, 5e5,
+                                                                      8000, 3000)
+    assert abs(p[-1]) < 1e-6*p[0] and np.all(np.diff(p) < 0)
+    P = hydrostatic_2layer_incompressible_pressure_profile(R, [4e5, 5e5],
+                                                           8000, [3000, 3000])
+    assert P.shape == (2, R.size) and np.allclose(P[1], p)
+    p1 = hydrostatic_1layer_incompressible_pressure_profile(R, 3000)
+    assert np.allclose(p1, hydrostatic_2layer_incompressible_pressure_profile(
+        R, 5e5, 3000, 3000), rtol=1e-12, atol=1e-6)
+    pn = hydrostatic_nlayer_incompressible_pressure_profile(R, [2e5, 5e5],
+                                                            [8000, 8000, 3000])
+    assert np.allclose(pn, p, rtol=1e-12, atol=1e-6)
+    pt, pc = hydrostatic_tabulated_pressure_profile([0, 2e5, 5e5, 5e5, 1e6],
+                                                    [8000, 8000, 8000, 3000, 3000])
+    assert np.allclose(pt, p[[0, 200, 500, 500, 1000]], rtol=1e-10, atol=1e-6)
+    assert np.isclose(pc, p[0], rtol=1e-10)
+    r = np.concatenate([np.linspace(0, 5e5, 50), np.linspace(5e5, 1e6, 50)])
+    eos = [ConstantDensityEOS(8000), ConstantDensityEOS(3000)]
+    rho, pr, pc, n = hydrostatic_compressible_pressure_profile(r, eos, [5e5])
+    assert n == 1 and np.isclose(pc, p[0], rtol=1e-10)
+    eos = [PolytropeEOS.iron(), PolytropeEOS.perovskite()]
+    rho, pr, pc, n = hydrostatic_compressible_pressure_profile(r, eos, [5e5])
+    assert np.all(rho >= [8300]*50 + [4100]*50) and pc > p[0]
+    assert hydrostatic_compressible_pressure_profile(r, eos, [5e5], rho)[3] == 1
+    r = np.concatenate([np.linspace(0, 5e5, 50), np.linspace(5e5, 6e5, 50)])
+    eos = [PolytropeEOS.iron(), IdealGasEOS(300.0)]
+    rho, pr, pc, n = hydrostatic_compressible_pressure_profile(r, eos, [5e5],
+                                                               p_surf=1e5)
+    assert pr[-1] == 1e5 and np.isclose(rho[-1], 1e5*2.3e-3/(8.314462618*300))
+    assert np.allclose(rho[50:], eos[1].density(pr[50:]), rtol=1e-9)
+    try:
+        type('NoDensityEOS', (EquationOfState,), {})()
+        raise AssertionError("EquationOfState without density instantiated")
+    except TypeError:
+        pass
+    a = sphereslice([1, 0.3, 0.5, 0.5], [0, 0.2, 0.7, np.pi/2], [0, 0, 0.3, 0])
+    assert np.allclose(a[0], 1) and np.isclose(a[1,1], 1) and np.all(a[3] == 0)
+    assert np.allclose(a[2], [0.0722261, 0.3622214], atol=1e-6)
+    import tempfile
+    X = np.arange(12, dtype='>f4').reshape(4, 3)
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'test.xdr')
+        with open(fname, 'wb') as f:
+            f.write(b"CSPH test dump\n4, 3\n^^^\n" + X.tobytes())
+        data, header = xdr2np(fname, be=True)
+        assert data.shape == (4, 3) and np.all(data == X)
+        assert header.endswith("^^^\n")
+        x, z = xdr2np(fname, be=True, columns=[0, 2])[0]
+        assert np.all(x == X[:,0]) and np.all(z == X[:,2])
+        del data, x, z
+    print("psci_helpers: all tests passed")
     pass
 
 if __name__ == "__main__":